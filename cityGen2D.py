@@ -15,56 +15,554 @@ python3 cityGen2D.py
 Run option 2: (using python bundled with blender)
 blender --background --python cityGen2D.py
 
-TODO:
-* Try a Poison-disk sampling for generating the random seeds
+Use --seeding bridson to generate the random seeds with Poisson-disk sampling
   see: https://sighack.com/post/poisson-disk-sampling-bridsons-algorithm
+Use --seeding tiles to stamp precomputed Poisson-disk tiles (cached as cg-tiles-*.npy)
+Use --outOfCore DIR for very large maps: the big arrays (regions, region lines,
+metrics) are kept as memory mapped files in folder DIR, and processed and exported
+by chunks. The all-pairs AI matrices are skipped (only the neighbours are saved).
+The triangulation, relaxation, vertex merge and region adjacency still run in
+memory, so the peak memory still grows with the map
 """
 
-import math, json, importlib, random
+import math, json, importlib, random, os, sys, time
+from fractions import Fraction
 from math import sqrt, acos, ceil
 from pprint import pprint
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 
+# Geometry kernels shared with cityGen3D.py
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from cityGenGeometry import offsetPolygon, offsetPolygons, regionMoments, regionMetrics, rmdfPolyline, RegionList, \
+    polygonNeighbours
+
+# Optional module to report the peak memory (not available in windows)
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Optional compiled backend for the triangulation
+try:
+    from scipy.spatial import Delaunay as QhullDelaunay
+except ImportError:
+    QhullDelaunay = None
+
+def circumcircles(a, b, c):
+    """Compute circumcenters and squared circumradius of a batch of triangles.
+    a, b, c -- Arrays (n x 2) with the coordinates of the corners of each triangle
+    Closed form solution, after translate each triangle so a is the origin.
+    ref: https://en.wikipedia.org/wiki/Circumscribed_circle#Cartesian_coordinates_2
+    """
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64) - a
+    c = np.asarray(c, dtype=np.float64) - a
+    b2 = np.sum(b * b, axis=-1)
+    c2 = np.sum(c * c, axis=-1)
+    d = 2.0 * (b[..., 0] * c[..., 1] - b[..., 1] * c[..., 0])
+    ux = (c[..., 1] * b2 - b[..., 1] * c2) / d
+    uy = (b[..., 0] * c2 - c[..., 0] * b2) / d
+    center = a + np.stack((ux, uy), axis=-1)
+    radius = ux * ux + uy * uy  # squared distance
+    return center, radius
+
+
+def hilbertIndex(points, order=16):
+    """Compute the position of each point along a Hilbert curve that fills
+    the bounding box of the points, using a grid of 2^order x 2^order cells.
+    ref: https://en.wikipedia.org/wiki/Hilbert_curve#Applications_and_mapping_algorithms
+    """
+    points = np.asarray(points, dtype=np.float64)
+    side = (1 << order) - 1
+    lo = points.min(axis=0)
+    size = max(np.max(points.max(axis=0) - lo), 1e-12)
+    x, y = ((points - lo) * (side / size)).astype(np.int64).T
+    d = np.zeros(len(points), dtype=np.int64)
+    s = 1 << (order - 1)
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        d += s * s * ((3 * rx) ^ ry)
+        # Rotate the quadrant, so the curve is continuous
+        flip = ~ry & rx
+        x = np.where(flip, side - x, x)
+        y = np.where(flip, side - y, y)
+        swap = ~ry
+        x, y = np.where(swap, y, x), np.where(swap, x, y)
+        s >>= 1
+    return d
+
+
+def insertionOrder(points, order='brio', randomSeed=0):
+    """Compute an order to insert points in a triangulation.
+    'hilbert' -- Sort points along a Hilbert curve.
+    'brio'    -- Biased Randomized Insertion Order. Points are split in rounds
+                 (each about the half of the previous) that are inserted from
+                 the smallest to the largest. Each round is sorted by Hilbert.
+    None      -- Keep the input order.
+    ref: Amenta, Choi, Rote "Incremental constructions con BRIO" (2003)
+    """
+    n = len(points)
+    if order is None or n < 2:
+        return np.arange(n)
+    if order == 'hilbert':
+        return np.argsort(hilbertIndex(points), kind='stable')
+    if order == 'brio':
+        # Use its own generator, so global random state is not modified
+        rng = np.random.RandomState(randomSeed)
+        rounds = np.floor(-np.log2(1.0 - rng.random_sample(n))).astype(np.int64)
+        return np.lexsort((hilbertIndex(points), -rounds))
+    raise ValueError("Unknown insertion order: %s" % order)
+
+
+def poissonDiskDistance(numSeeds, halfSize):
+    """Largest min distance that fits numSeeds Poisson-disk seeds in the square
+    [-halfSize, halfSize]^2. A full (maximal) Poisson-disk set holds about
+    0.62 / distance^2 seeds per unit of area, so 0.56 is used to get about 10%
+    more, even with the random cut of a tile (the samplers keep the seeds
+    nearest to the center).
+    """
+    return sqrt(0.56 * (2 * halfSize) ** 2 / numSeeds)
+
+
+def poissonDiskSeeds(numSeeds, halfSize, minDistance, fixedSeeds=(), k=30, periodic=False, growFrom=None):
+    """Generate random seeds in the square [-halfSize, halfSize]^2, with no
+    two seeds (or a seed and a fixed seed) nearer than minDistance, using
+    Bridson's algorithm with a background grid of cells of side
+    minDistance/sqrt(2) (so each cell holds one seed at most).
+    numSeeds   -- Number of seeds requested. May return less if they do not fit. If more
+                  fit, the nearest to the center are kept (use None to keep all)
+    fixedSeeds -- Array (m x 2) of seeds already placed. The sampling grows from them
+    k          -- Number of candidates tested around each active seed
+    periodic   -- Wrap the square as a torus (to build tiles with no seams)
+    growFrom   -- Indices of the fixed seeds the sampling grows from. Default: all of them
+    Uses the global np.random state. Returns an array (n x 2) of new seeds.
+    ref: https://www.cs.ubc.ca/~rbridson/docs/bridson-siggraph07-poissondisk.pdf
+    """
+    cell = minDistance / sqrt(2)
+    size = int(ceil(2 * halfSize / cell))
+    if periodic:
+        cell = 2 * halfSize / size
+    # Cells to check around a candidate. Pad the grid, so the window never goes out of range
+    w = int(ceil(minDistance / cell))
+    pad = 0 if periodic else w
+    grid = np.full((size + 2 * pad, size + 2 * pad), -1, dtype=np.int64)
+    dy, dx = np.mgrid[-w:w + 1, -w:w + 1].reshape((2, 1, -1))
+    fixedSeeds = np.asarray(fixedSeeds, dtype=np.float64).reshape((-1, 2))
+    points = np.zeros((len(fixedSeeds) + size * size, 2))
+    r2 = minDistance * minDistance
+
+    def cellOf(p):
+        c = np.floor((p + halfSize) / cell).astype(np.int64) + pad
+        return c % size if periodic else np.clip(c, 0, size + 2 * pad - 1)
+
+    # Fixed seeds may be nearer than minDistance. Those sharing a cell are checked apart
+    extras = []
+    for n, p in enumerate(fixedSeeds):
+        points[n] = p
+        i, j = cellOf(p)
+        if grid[i, j] < 0:
+            grid[i, j] = n
+        else:
+            extras.append(p)
+    extras = np.array(extras).reshape((-1, 2))
+    n = len(fixedSeeds)
+    active = list(range(n)) if growFrom is None else list(growFrom)
+    if n == 0:
+        points[0] = 2 * halfSize * np.random.random(2) - halfSize
+        grid[tuple(cellOf(points[0]))] = 0
+        active = [0]
+        n = 1
+
+    while active:
+        a = np.random.randint(len(active))
+        # Test k candidates uniformly distributed in the annulus [r, 2r] around the active seed
+        angle = 2 * np.pi * np.random.random(k)
+        dist = minDistance * np.sqrt(1 + 3 * np.random.random(k))
+        cand = points[active[a]] + np.column_stack((dist * np.cos(angle), dist * np.sin(angle)))
+        if periodic:
+            cand = (cand + halfSize) % (2 * halfSize) - halfSize
+        else:
+            cand = cand[np.all(np.abs(cand) <= halfSize, axis=1)]
+        ci = cellOf(cand)
+        near = grid[(ci[:, 0, None] + dy[0]) % len(grid), (ci[:, 1, None] + dx[0]) % len(grid)]
+        diff = points[near] - cand[:, None]
+        if periodic:
+            diff -= 2 * halfSize * np.round(diff / (2 * halfSize))
+        d2 = np.where(near >= 0, (diff ** 2).sum(axis=2), np.inf)
+        valid = d2.min(axis=1, initial=np.inf) >= r2
+        if len(extras):
+            valid &= (((extras[None] - cand[:, None]) ** 2).sum(axis=2) >= r2).all(axis=1)
+        if valid.any():
+            c = np.argmax(valid)
+            points[n] = cand[c]
+            grid[ci[c, 0], ci[c, 1]] = n
+            active.append(n)
+            n += 1
+        else:
+            # No room around this seed. Remove it from the active list
+            active[a] = active[-1]
+            active.pop()
+
+    # The result fills the square. Trim the corners: keep the seeds nearest to the center
+    # (a random subset would leave holes in the distribution)
+    newSeeds = points[len(fixedSeeds):n]
+    pick = np.argsort((newSeeds ** 2).sum(axis=1), kind='stable')[:numSeeds]
+    return newSeeds[pick]
+
+
+# Tiles already loaded by blueNoiseTiles(), by filename
+blueNoiseTileCache = {}
+
+
+def blueNoiseTiles(numTiles=8, tileDistance=1/40, filename=None):
+    """Load a set of toroidal Poisson-disk tiles, or build and save them if
+    the file does not exist. Each tile is a set of points in the unit square
+    with no two points nearer than tileDistance, even across the borders,
+    so a tile can be repeated side by side with no seams.
+    filename -- .npy file with an array (n x 3): tile index, x, y of each point.
+                Default: "cg-tiles-<numTiles>-<1/tileDistance>.npy"
+    Returns a list with an array (m x 2) for each tile.
+    """
+    if filename is None:
+        filename = "cg-tiles-%d-%g.npy" % (numTiles, 1 / tileDistance)
+    if filename in blueNoiseTileCache:
+        return blueNoiseTileCache[filename]
+    if os.path.exists(filename):
+        data = np.load(filename)
+    else:
+        print("Building blue noise tiles", filename)
+        # Use its own random state, so the tiles do not depend on the city randomSeed
+        state = np.random.get_state()
+        np.random.seed(numTiles)
+        data = np.concatenate([np.column_stack((np.full(len(t), i), t + 0.5)) for i, t in enumerate(
+            poissonDiskSeeds(None, 0.5, tileDistance, periodic=True) for _ in range(numTiles))])
+        np.random.set_state(state)
+        np.save(filename, data)
+    tiles = [data[data[:, 0] == i, 1:] for i in range(numTiles)]
+    blueNoiseTileCache[filename] = tiles
+    return tiles
+
+
+def tiledSeeds(numSeeds, halfSize, minDistance, fixedSeeds=(), jitter=0.1, numTiles=8, tileDistance=1/40):
+    """Generate random seeds in the square [-halfSize, halfSize]^2, with no
+    two seeds (or a seed and a fixed seed) nearer than minDistance, stamping
+    a precomputed blue noise tile (see blueNoiseTiles).
+    A random tile is chosen, with a random symmetry and offset. It is scaled
+    so its points are minDistance apart, and each point is moved randomly up
+    to jitter*minDistance/2, but never more than the half of its slack (the
+    distance to its nearest neighbour beyond minDistance), so the min distance
+    is kept. The holes left around the fixed seeds are filled with Bridson's
+    algorithm (see poissonDiskSeeds).
+    numSeeds -- Number of seeds requested. May return less if they do not fit.
+                If more fit, the nearest to the center are kept
+    Uses the global np.random state. Returns an array (n x 2) of new seeds.
+    """
+    tiles = blueNoiseTiles(numTiles, tileDistance)
+    tile = tiles[np.random.randint(len(tiles))]
+    # Distance from each point to its nearest neighbour, across the borders of the torus
+    copies = np.concatenate([tile + (x, y) for x in (-1, 0, 1) for y in (-1, 0, 1)])
+    i, j = nearPairs(copies, 2 * tileDistance)
+    dist = np.sqrt(((copies[i] - copies[j]) ** 2).sum(axis=1))
+    nearest = np.full(len(copies), 2 * tileDistance)
+    np.minimum.at(nearest, i, dist)
+    np.minimum.at(nearest, j, dist)
+    nearest = nearest.reshape((9, -1)).min(axis=0)
+    # Apply one of the 8 symmetries of the square, and a random offset on the torus
+    if np.random.randint(2):
+        tile = tile[:, ::-1]
+    tile = np.where(np.random.randint(2, size=2) > 0, 1 - tile, tile)
+    tile = (tile + np.random.random(2)) % 1.0
+
+    # Repeat the tile to cover the square
+    scale = minDistance / tileDistance
+    n = int(ceil(2 * halfSize / scale))
+    y, x = np.mgrid[0:n, 0:n]
+    offsets = np.column_stack((x.ravel(), y.ravel()))
+    points = ((tile[None] + offsets[:, None]).reshape((-1, 2)) * scale - halfSize)
+    maxMove = np.minimum(0.5 * jitter * minDistance, 0.5 * (nearest * scale - minDistance))
+    angle = 2 * np.pi * np.random.random(len(points))
+    dist = np.tile(maxMove, len(offsets)) * np.sqrt(np.random.random(len(points)))
+    points += np.column_stack((dist * np.cos(angle), dist * np.sin(angle)))
+
+    # Remove the points outside the square, or too near of a fixed seed
+    fixedSeeds = np.asarray(fixedSeeds, dtype=np.float64).reshape((-1, 2))
+    valid = np.all(np.abs(points) <= halfSize, axis=1)
+    nearFixed = np.zeros(len(points), dtype=bool)
+    for p in fixedSeeds:
+        d2 = ((points - p) ** 2).sum(axis=1)
+        valid &= d2 >= minDistance * minDistance
+        nearFixed |= d2 < 4 * minDistance * minDistance
+    points, nearFixed = points[valid], nearFixed[valid]
+
+    # Fill the holes around the fixed seeds, growing from them and from the points around
+    growFrom = np.concatenate((np.arange(len(fixedSeeds)), len(fixedSeeds) + np.flatnonzero(nearFixed)))
+    fill = poissonDiskSeeds(None, halfSize, minDistance, np.concatenate((fixedSeeds, points)), growFrom=growFrom)
+    points = np.concatenate((points, fill))
+    pick = np.argsort((points ** 2).sum(axis=1), kind='stable')[:numSeeds]
+    return points[pick]
+
+
+class RegionPlacer:
+    """
+    Place circular regions (the static models) at random positions in a
+    square, with no overlap between regions. A grid of cells keeps the
+    clearance of each cell (distance from its center to the nearest region)
+    so candidates are only drawn from cells with room for a new region.
+    """
+
+    def __init__(self, low, high, cellSize=None):
+        """ Init an empty square [low, high]^2
+        cellSize -- Side of the cells of the grid. Default: (high-low)/64
+        """
+        self.low = low
+        self.cellSize = cellSize or (high - low) / 64
+        n = max(1, int(ceil((high - low) / self.cellSize)))
+        self.cellSize = (high - low) / n
+        y, x = np.mgrid[0:n, 0:n]
+        self.cellCenters = low + self.cellSize * (np.column_stack((x.ravel(), y.ravel())) + 0.5)
+        self.clearance = np.full(n * n, np.inf)
+        self.centers = np.empty((0, 2))
+        self.radii = np.empty(0)
+
+    def add(self, pos, radius):
+        """Add a region at pos (without any check)
+        """
+        pos = np.asarray(pos, dtype=np.float64)
+        self.centers = np.vstack((self.centers, pos))
+        self.radii = np.append(self.radii, radius)
+        dist = np.linalg.norm(self.cellCenters - pos, axis=1) - radius
+        np.minimum(self.clearance, dist, out=self.clearance)
+
+    def place(self, radius, maxCandidates=1024, batchSize=64):
+        """Find a random position for a new region and add it.
+        Test batches of random candidates, drawn from the cells with room for
+        the region, until one is valid or maxCandidates are tested.
+        Uses the global np.random state. Raise ValueError if there is no room.
+        """
+        # A cell has room if some point of the cell may be far enough of all regions
+        freeCells = np.flatnonzero(self.clearance + self.cellSize / sqrt(2) >= radius)
+        tested = 0
+        while len(freeCells) and tested < maxCandidates:
+            n = min(batchSize, maxCandidates - tested)
+            cells = freeCells[np.random.randint(len(freeCells), size=n)]
+            cand = (self.cellCenters[cells] + self.cellSize * (np.random.random((n, 2)) - 0.5)).round(2)
+            dist = np.linalg.norm(cand[:, None] - self.centers[None], axis=2) - self.radii
+            valid = np.flatnonzero(dist.min(axis=1, initial=np.inf) >= radius)
+            if len(valid):
+                self.add(cand[valid[0]], radius)
+                return cand[valid[0]]
+            tested += n
+        raise ValueError("No room for a region of radius %g after %d candidates (%d free cells)" % (
+            radius, tested, len(freeCells)))
+
+
+class Predicates:
+    """
+    Orientation and incircle tests for points in 2D. Uses plain floats and a
+    static error bound, and only falls back to exact arithmetic (fractions)
+    when the floating point result is too small to be trusted.
+    ref: http://www.cs.cmu.edu/~quake/robust.html
+    """
+    # Error bounds of the floating point evaluation, from Shewchuk's paper
+    epsilon = 2.0 ** -53
+    ccwErrBound = (3.0 + 16.0 * epsilon) * epsilon
+    iccErrBound = (10.0 + 96.0 * epsilon) * epsilon
+
+    def __init__(self):
+        # Count the number of tests, and how many needed exact arithmetic
+        self.counters = {'orient2d': 0, 'orient2dExact': 0, 'inCircle': 0, 'inCircleExact': 0}
+
+    def orient2d(self, a, b, c):
+        """Positive if a, b, c are in CCW order, negative if CW, zero if collinear.
+        """
+        self.counters['orient2d'] += 1
+        detleft = (a[0] - c[0]) * (b[1] - c[1])
+        detright = (a[1] - c[1]) * (b[0] - c[0])
+        det = detleft - detright
+        if abs(det) > self.ccwErrBound * (abs(detleft) + abs(detright)):
+            return det
+
+        # Ambiguous sign. Repeat with exact arithmetic
+        self.counters['orient2dExact'] += 1
+        ax, ay, bx, by, cx, cy = map(Fraction, (a[0], a[1], b[0], b[1], c[0], c[1]))
+        det = (ax - cx) * (by - cy) - (ay - cy) * (bx - cx)
+        return float(det.numerator > 0) - float(det.numerator < 0)
+
+    def inCircle(self, a, b, c, d):
+        """Positive if d is inside the circle through a, b, c (in CCW order),
+        negative if outside, and zero if the four points are cocircular.
+        """
+        self.counters['inCircle'] += 1
+        adx, ady = a[0] - d[0], a[1] - d[1]
+        bdx, bdy = b[0] - d[0], b[1] - d[1]
+        cdx, cdy = c[0] - d[0], c[1] - d[1]
+        alift = adx * adx + ady * ady
+        blift = bdx * bdx + bdy * bdy
+        clift = cdx * cdx + cdy * cdy
+        bdxcdy, cdxbdy = bdx * cdy, cdx * bdy
+        cdxady, adxcdy = cdx * ady, adx * cdy
+        adxbdy, bdxady = adx * bdy, bdx * ady
+        det = (alift * (bdxcdy - cdxbdy) + blift * (cdxady - adxcdy) + clift * (adxbdy - bdxady))
+        permanent = ((abs(bdxcdy) + abs(cdxbdy)) * alift + (abs(cdxady) + abs(adxcdy)) * blift
+                     + (abs(adxbdy) + abs(bdxady)) * clift)
+        if abs(det) > self.iccErrBound * permanent:
+            return det
+
+        # Ambiguous sign. Repeat with exact arithmetic
+        self.counters['inCircleExact'] += 1
+        dx, dy = Fraction(d[0]), Fraction(d[1])
+        adx, ady = Fraction(a[0]) - dx, Fraction(a[1]) - dy
+        bdx, bdy = Fraction(b[0]) - dx, Fraction(b[1]) - dy
+        cdx, cdy = Fraction(c[0]) - dx, Fraction(c[1]) - dy
+        det = ((adx * adx + ady * ady) * (bdx * cdy - cdx * bdy)
+               + (bdx * bdx + bdy * bdy) * (cdx * ady - adx * cdy)
+               + (cdx * cdx + cdy * cdy) * (adx * bdy - bdx * ady))
+        return float(det.numerator > 0) - float(det.numerator < 0)
+
+
 class Delaunay2D:
     """
     Class to compute a Delaunay triangulation in 2D
     ref: http://en.wikipedia.org/wiki/Bowyer-Watson_algorithm
     ref: http://www.geom.uiuc.edu/~samuelp/del_project.html
+
+    Triangles are stored in preallocated numpy arrays, indexed by slot:
+      tris[t]       -- The three vertex of triangle t, in CCW order.
+      neighbours[t] -- The triangle opposite to each vertex of t (-1 if none)
+      centers[t]    -- The circumcenter of triangle t
+      radii[t]      -- The squared circumradius of triangle t
+    Slots of deleted triangles are marked with tris[t,0] = -1 and kept in
+    a free-list to be reused by the next created triangles.
     """
 
-    def __init__(self, center=(0, 0), radius=9999):
+    def __init__(self, center=(0, 0), radius=9999, locate='walk', predicate='filtered', capacity=64):
         """ Init and create a new frame to contain the triangulation
         center -- Optional position for the center of the frame. Default (0,0)
         radius -- Optional distance from corners to the center.
+        locate -- Method to find the triangles in conflict with a new point:
+                  'walk' follows neighbour links from the last created triangle
+                  'scan' checks every triangle (slow, kept as reference)
+        predicate -- Incircle test used to find triangles in conflict:
+                  'filtered' fast floating point test, exact when ambiguous
+                  'fast' compare with the precomputed circumcircle
+                  'robust' compute the determinant with np.linalg.det
+        capacity -- Initial number of vertex to allocate. Grows as needed.
         """
+        if locate not in ('walk', 'scan'):
+            raise ValueError("Unknown locate method: %s" % locate)
+        self.locate = locate
+        self.predicates = Predicates()
+        inCircle = {'filtered': self.inCircleFiltered,
+                    'fast': self.inCircleFast,
+                    'robust': self.inCircleRobust}
+        if predicate not in inCircle:
+            raise ValueError("Unknown predicate: %s (use %s)" % (predicate, ', '.join(inCircle)))
+        self.inCircle = inCircle[predicate]
+
+        # Preallocate storage for vertex and triangles (about 2 per vertex)
+        capacity = max(capacity, 4)
+        self.coords = np.empty((capacity, 2), dtype=np.float64)
+        self.numCoords = 0
+        self.tris = np.full((2 * capacity, 3), -1, dtype=np.int32)
+        self.neighbours = np.full((2 * capacity, 3), -1, dtype=np.int32)
+        self.centers = np.empty((2 * capacity, 2), dtype=np.float64)
+        self.radii = np.empty(2 * capacity, dtype=np.float64)
+        self.numTris = 0
+        self.freeTris = []
+        # Store an incident triangle for each vertex (-1 if none)
+        self.vertexTri = np.full(capacity, -1, dtype=np.int32)
+
         center = np.asarray(center)
         # Create coordinates for the corners of the frame
-        self.coords = [center+radius*np.array((-1, -1)),
-                       center+radius*np.array((+1, -1)),
-                       center+radius*np.array((+1, +1)),
-                       center+radius*np.array((-1, +1))]
-
-        # Create two dicts to store triangle neighbours and circumcircles.
-        self.triangles = {}
-        self.circles = {}
+        self.coords[0:4] = center + radius * np.array(((-1, -1), (+1, -1), (+1, +1), (-1, +1)))
+        self.numCoords = 4
 
         # Create two CCW triangles for the frame
-        T1 = (0, 1, 3)
-        T2 = (2, 3, 1)
-        self.triangles[T1] = [T2, None, None]
-        self.triangles[T2] = [T1, None, None]
+        T1, T2 = self.newTriangles(2)
+        self.tris[T1] = (0, 1, 3)
+        self.tris[T2] = (2, 3, 1)
+        self.neighbours[T1] = (T2, -1, -1)
+        self.neighbours[T2] = (T1, -1, -1)
+        self.vertexTri[0:4] = (T1, T1, T2, T1)
 
         # Compute circumcenters and circumradius for each triangle
-        for t in self.triangles:
-            self.circles[t] = self.circumcenter(t)
+        self.updateCircles([T1, T2])
+
+        # Starting triangle for the next walk
+        self.lastTriangle = T1
+
+    def reserve(self, numCoords):
+        """Ensure there is storage for numCoords vertex (and its triangles)
+        """
+        if numCoords > len(self.coords):
+            capacity = max(numCoords, 2 * len(self.coords))
+            self.coords = np.resize(self.coords, (capacity, 2))
+            grow = capacity - len(self.vertexTri)
+            self.vertexTri = np.concatenate((self.vertexTri, np.full(grow, -1, dtype=np.int32)))
+        numTris = 2 * numCoords
+        if numTris > len(self.tris):
+            capacity = max(numTris, 2 * len(self.tris))
+            grow = capacity - len(self.tris)
+            self.tris = np.vstack((self.tris, np.full((grow, 3), -1, dtype=np.int32)))
+            self.neighbours = np.vstack((self.neighbours, np.full((grow, 3), -1, dtype=np.int32)))
+            self.centers = np.resize(self.centers, (capacity, 2))
+            self.radii = np.resize(self.radii, capacity)
+
+    def newTriangles(self, n):
+        """Get n free slots to store new triangles. Reuse deleted slots first.
+        """
+        slots = [self.freeTris.pop() for _ in range(min(n, len(self.freeTris)))]
+        if len(slots) < n:
+            first = self.numTris
+            self.numTris += n - len(slots)
+            if self.numTris > len(self.tris):
+                self.reserve((self.numTris + 1) // 2)
+            slots += range(first, self.numTris)
+        return slots
+
+    def deleteTriangles(self, slots):
+        """Mark the triangles as deleted, and store the slots for reuse.
+        """
+        self.tris[slots, 0] = -1
+        self.freeTris.extend(slots)
+
+    def setTriangles(self, tris, neighbours):
+        """Replace all the triangles of the DT, using the vertex in coords.
+        tris       -- Array (n x 3) with the vertex of each triangle in CCW order
+        neighbours -- Array (n x 3) with the triangle opposite to each vertex
+        """
+        self.numTris = 0
+        self.freeTris = []
+        self.tris[:] = -1
+        slots = self.newTriangles(len(tris))
+        self.tris[slots] = tris
+        self.neighbours[slots] = neighbours
+        self.vertexTri[:self.numCoords] = -1
+        self.vertexTri[self.tris[slots].ravel()] = np.repeat(slots, 3)
+        self.updateCircles(slots)
+        self.lastTriangle = 0
+
+    def liveTriangles(self):
+        """Return the slots of the current (non deleted) triangles
+        """
+        return np.flatnonzero(self.tris[:self.numTris, 0] >= 0)
+
+    def updateCircles(self, slots):
+        """Compute and store the circumcircles of the triangles in slots.
+        """
+        pts = self.coords[self.tris[slots]]
+        self.centers[slots], self.radii[slots] = circumcircles(pts[:, 0], pts[:, 1], pts[:, 2])
 
     def circumcenter(self, tri):
         """Compute circumcenter and circumradius of a triangle in 2D.
         Uses an extension of the method described here:
         http://www.ics.uci.edu/~eppstein/junkyard/circumcenter.html
+        Slow. Kept as reference, see circumcircles() for a batched version.
         """
-        pts = np.asarray([self.coords[v] for v in tri])
+        pts = self.coords[np.asarray(tri)]
         pts2 = np.dot(pts, pts.T)
         A = np.bmat([[2 * pts2, [[1],
                                  [1],
@@ -83,33 +581,102 @@ class Delaunay2D:
     def inCircleFast(self, tri, p):
         """Check if point p is inside of precomputed circumcircle of tri.
         """
-        center, radius = self.circles[tri]
-        return np.sum(np.square(center - p)) <= radius
+        return np.sum(np.square(self.centers[tri] - p)) <= self.radii[tri]
 
     def inCircleRobust(self, tri, p):
         """Check if point p is inside of circumcircle around the triangle tri.
         This is a robust predicate, slower than compare distance to centers
         ref: http://www.cs.cmu.edu/~quake/robust.html
         """
-        m1 = np.asarray([self.coords[v] - p for v in tri])
+        m1 = self.coords[self.tris[tri]] - p
         m2 = np.sum(np.square(m1), axis=1).reshape((3, 1))
         m = np.hstack((m1, m2))    # The 3x3 matrix to check
         return np.linalg.det(m) <= 0
 
+    def inCircleFiltered(self, tri, p):
+        """Check if point p is strictly inside of circumcircle of tri.
+        Uses the filtered predicates, so it is exact for near cocircular points.
+        """
+        a, b, c = self.coords[self.tris[tri]].tolist()
+        return self.predicates.inCircle(a, b, c, p) > 0
+
+    def walk(self, p, T=None):
+        """Search the triangle that contains point p, walking over the
+        neighbour links. Starts at triangle T or at the last created one.
+        ref: Devillers et al. "Walking in a triangulation" (2001)
+        """
+        if T is None or self.tris[T, 0] < 0:
+            T = self.lastTriangle
+        p = np.asarray(p, dtype=np.float64).tolist()
+        orient2d = self.predicates.orient2d
+        previous = -1
+        while True:
+            tri = self.coords[self.tris[T]].tolist()
+            # Move to the neighbour through the first edge that has p at its
+            # right side. Skip the edge we come from, it is already checked.
+            for edge, tri_op in enumerate(self.neighbours[T].tolist()):
+                if tri_op >= 0 and tri_op != previous and \
+                   orient2d(tri[(edge+1) % 3], tri[(edge-1) % 3], p) < 0:
+                    previous, T = T, tri_op
+                    break
+            else:
+                return T
+
+    def badTriangles(self, p):
+        """Search the triangle(s) whose circumcircle contains p.
+        """
+        if self.locate == 'scan':
+            return [T for T in self.liveTriangles().tolist() if self.inCircle(T, p)]
+
+        # The triangle containing p is always in conflict. The rest of the
+        # cavity is connected to it, so grow it as a BFS over the neighbours
+        T = self.walk(p)
+        p = np.asarray(p, dtype=np.float64).tolist()
+        bad_triangles = [T]
+        visited = {T, -1}
+        for T in bad_triangles:
+            for tri_op in self.neighbours[T].tolist():
+                if tri_op not in visited:
+                    visited.add(tri_op)
+                    if self.inCircle(tri_op, p):
+                        bad_triangles.append(tri_op)
+        return bad_triangles
+
     def addPoint(self, p):
         """Add a point to the current DT, and refine it using Bowyer-Watson.
         """
-        p = np.asarray(p)
-        idx = len(self.coords)
+        idx = self.numCoords
         # print("coords[", idx,"] ->",p)
-        self.coords.append(p)
+        self.reserve(idx + 1)
+        self.coords[idx] = p
+        self.numCoords += 1
+        self.insertVertex(idx)
+
+    def addPoints(self, points, order='brio', randomSeed=0):
+        """Add a set of points to the current DT.
+        Each point gets the same index as if inserted one by one with addPoint,
+        but they are inserted in a spatially sorted order, so each walk starts
+        near of the previous point.
+        points -- Array (n x 2) with the coordinates to insert
+        order  -- Insertion order: 'brio', 'hilbert' or None (input order)
+        randomSeed -- Seed for the random rounds of 'brio' order
+        """
+        points = np.asarray(points, dtype=np.float64).reshape((-1, 2))
+        first = self.numCoords
+        self.reserve(first + len(points))
+        self.coords[first:first + len(points)] = points
+        self.numCoords += len(points)
+        for i in insertionOrder(points, order, randomSeed).tolist():
+            self.insertVertex(first + i)
+
+    def insertVertex(self, idx):
+        """Insert the vertex coords[idx] in the DT, using Bowyer-Watson.
+        """
+        p = self.coords[idx]
 
         # Search the triangle(s) whose circumcircle contains p
-        bad_triangles = []
-        for T in self.triangles:
-            # Choose one method: inCircleRobust(T, p) or inCircleFast(T, p)
-            if self.inCircleFast(T, p):
-                bad_triangles.append(T)
+        bad_triangles = self.badTriangles(p)
+        bad_set = set(bad_triangles)
 
         # Find the CCW boundary (star shape) of the bad triangles,
         # expressed as a list of edges (point pairs) and the opposite
@@ -122,10 +689,10 @@ class Delaunay2D:
         while True:
             # Check if edge of triangle T is on the boundary...
             # if opposite triangle of this edge is external to the list
-            tri_op = self.triangles[T][edge]
-            if tri_op not in bad_triangles:
+            tri_op = int(self.neighbours[T, edge])
+            if tri_op not in bad_set:
                 # Insert edge and external triangle into boundary list
-                boundary.append((T[(edge+1) % 3], T[(edge-1) % 3], tri_op))
+                boundary.append((int(self.tris[T, (edge+1) % 3]), int(self.tris[T, (edge-1) % 3]), tri_op))
 
                 # Move to next CCW edge in this triangle
                 edge = (edge + 1) % 3
@@ -135,117 +702,997 @@ class Delaunay2D:
                     break
             else:
                 # Move to next CCW edge in opposite triangle
-                edge = (self.triangles[tri_op].index(T) + 1) % 3
+                edge = (self.neighbours[tri_op].tolist().index(T) + 1) % 3
                 T = tri_op
 
         # Remove triangles too near of point p of our solution
-        for T in bad_triangles:
-            del self.triangles[T]
-            del self.circles[T]
-
-        # Retriangle the hole left by bad_triangles
-        new_triangles = []
-        for (e0, e1, tri_op) in boundary:
-            # Create a new triangle using point p and edge extremes
-            T = (idx, e0, e1)
-
-            # Store circumcenter and circumradius of the triangle
-            self.circles[T] = self.circumcenter(T)
-
-            # Set opposite triangle of the edge as neighbour of T
-            self.triangles[T] = [tri_op, None, None]
-
-            # Try to set T as neighbour of the opposite triangle
-            if tri_op:
-                # search the neighbour of tri_op that use edge (e1, e0)
-                for i, neigh in enumerate(self.triangles[tri_op]):
-                    if neigh:
-                        if e1 in neigh and e0 in neigh:
-                            # change link to use our new triangle
-                            self.triangles[tri_op][i] = T
-
-            # Add triangle to a temporal list
-            new_triangles.append(T)
-
-        # Link the new triangles each another
-        N = len(new_triangles)
-        for i, T in enumerate(new_triangles):
-            self.triangles[T][1] = new_triangles[(i+1) % N]   # next
-            self.triangles[T][2] = new_triangles[(i-1) % N]   # previous
+        self.deleteTriangles(bad_triangles)
+
+        # Retriangle the hole left by bad_triangles, using point p and
+        # the extremes of each boundary edge
+        e0, e1, tri_op = np.array(boundary, dtype=np.int32).T
+        new_triangles = np.array(self.newTriangles(len(boundary)), dtype=np.int32)
+        self.tris[new_triangles] = np.column_stack((np.full_like(e0, idx), e0, e1))
+
+        # Set opposite triangle of the edge as neighbour of each new triangle
+        # and link the new triangles each another (next and previous)
+        self.neighbours[new_triangles] = np.column_stack((tri_op,
+                                                          np.roll(new_triangles, -1),
+                                                          np.roll(new_triangles, 1)))
+
+        # Set new triangles as neighbour of the opposite triangles. Search
+        # the vertex of tri_op not in edge (e1, e0): its opposite link
+        # must change to use the new triangle
+        outer = tri_op >= 0
+        ops = self.tris[tri_op[outer]]
+        k = np.argmax((ops != e0[outer, None]) & (ops != e1[outer, None]), axis=1)
+        self.neighbours[tri_op[outer], k] = new_triangles[outer]
+
+        # Every vertex of the cavity is on its boundary. Link them (and p)
+        # with one of the new triangles
+        self.vertexTri[e0] = new_triangles
+        self.vertexTri[idx] = new_triangles[0]
+
+        # Store circumcenter and circumradius of the new triangles
+        self.updateCircles(new_triangles)
+
+        # Next walk will start from here
+        self.lastTriangle = int(new_triangles[0])
+
+    def star(self, v):
+        """Return the CCW list of triangles incident to vertex v.
+        """
+        t0 = t = int(self.vertexTri[v])
+        star = []
+        while True:
+            star.append(t)
+            tri = self.tris[t].tolist()
+            t = int(self.neighbours[t, (tri.index(v) + 1) % 3])
+            if t == t0 or t < 0:
+                return star
+
+    def linkTriangles(self, t, k, u):
+        """Set triangle u as neighbour of t through its edge opposite to vertex
+        k, and t as neighbour of u through the same edge.
+        """
+        self.neighbours[t, k] = u
+        if u >= 0:
+            a, b = self.tris[t, (k+1) % 3], self.tris[t, (k-1) % 3]
+            ops = self.tris[u]
+            self.neighbours[u, np.argmax((ops != a) & (ops != b))] = t
+
+    def flip(self, t, k):
+        """Flip the edge of triangle t opposite to its vertex k.
+        Triangle t=(a,b,c) and its neighbour u=(d,c,b) are replaced by the
+        triangles t=(a,b,d) and u=(a,d,c). Returns the slots t, u.
+        """
+        a, b, c = (int(self.tris[t, (k+i) % 3]) for i in range(3))
+        u = int(self.neighbours[t, k])
+        ops = self.tris[u].tolist()
+        m = [i for i in range(3) if ops[i] != b and ops[i] != c][0]
+        d = ops[m]
+        # Neighbours through the external edges of the quad (a,b,d,c)
+        N_ab = int(self.neighbours[t, (k+2) % 3])
+        N_ca = int(self.neighbours[t, (k+1) % 3])
+        N_bd = int(self.neighbours[u, ops.index(c)])
+        N_dc = int(self.neighbours[u, ops.index(b)])
+
+        self.tris[t] = (a, b, d)
+        self.tris[u] = (a, d, c)
+        self.neighbours[t] = (-1, u, N_ab)
+        self.neighbours[u] = (-1, -1, t)
+        self.linkTriangles(t, 0, N_bd)
+        self.linkTriangles(u, 0, N_dc)
+        self.linkTriangles(u, 1, N_ca)
+        self.vertexTri[[a, b, c, d]] = (t, t, u, u)
+        self.updateCircles([t, u])
+        return t, u
+
+    def insertVertexByFlips(self, idx, T=None):
+        """Insert the vertex coords[idx] in the DT splitting the triangle that
+        contains it, and restore the Delaunay condition with edge flips.
+        ref: https://en.wikipedia.org/wiki/Delaunay_triangulation#Flip_algorithms
+        Returns the number of flips done.
+        """
+        p = self.coords[idx].tolist()
+        t = self.walk(p, T)
+        tri = self.coords[self.tris[t]].tolist()
+        if any(self.predicates.orient2d(tri[i-2], tri[i-1], p) == 0 for i in range(3)):
+            # p is on an edge. Let Bowyer-Watson deal with this case
+            self.insertVertex(idx)
+            return 0
+
+        # Split triangle t=(a,b,c) in three triangles (p,b,c) (p,c,a) (p,a,b)
+        a, b, c = self.tris[t].tolist()
+        N_a, N_b, N_c = self.neighbours[t].tolist()
+        t1, t2 = self.newTriangles(2)
+        self.tris[[t, t1, t2]] = ((idx, b, c), (idx, c, a), (idx, a, b))
+        self.neighbours[t] = (-1, t1, t2)
+        self.neighbours[t1] = (-1, t2, t)
+        self.neighbours[t2] = (-1, t, t1)
+        self.linkTriangles(t, 0, N_a)
+        self.linkTriangles(t1, 0, N_b)
+        self.linkTriangles(t2, 0, N_c)
+        self.vertexTri[[idx, a, b, c]] = (t, t1, t, t1)
+        self.updateCircles([t, t1, t2])
+
+        # Flip the edges opposite to p while they are not locally Delaunay
+        flips = 0
+        stack = [t, t1, t2]
+        while stack:
+            t = stack.pop()
+            u = int(self.neighbours[t, 0])
+            if u < 0:
+                continue
+            ops = self.tris[u].tolist()
+            d = [v for v in ops if v not in self.tris[t, 1:]][0]
+            if self.inCircle(t, self.coords[d].tolist()):
+                stack.extend(self.flip(t, 0))
+                flips += 1
+        self.lastTriangle = t
+        return flips
+
+    def removeVertex(self, i):
+        """Remove vertex i (index as in exportDT) from the triangulation.
+        The hole left by its star is retriangulated with Delaunay ears. The
+        coordinates of the vertex are kept, but it will have no region.
+        Returns one of the new triangles.
+        ref: Devillers "On deletion in Delaunay triangulations" (2002)
+        """
+        v = i + 4
+        star = self.star(v)
+        # Build the CCW polygon around v, and the triangles out of each side
+        poly, outer = [], []
+        for t in star:
+            tri = self.tris[t].tolist()
+            k = tri.index(v)
+            poly.append(tri[(k+1) % 3])
+            outer.append(int(self.neighbours[t, k]))
+        self.deleteTriangles(star)
+        self.vertexTri[v] = -1
+
+        # Clip ears while the polygon has more than a triangle.
+        # polygon side j goes from poly[j] to poly[j+1]
+        coords = self.coords[poly].tolist()
+        while True:
+            n = len(poly)
+            for j in range(n):
+                if n == 3:
+                    break
+                a, b, c = coords[j-1], coords[j], coords[(j+1) % n]
+                # Check the ear is convex and its circle is empty
+                if self.predicates.orient2d(a, b, c) > 0 and \
+                   not any(self.predicates.inCircle(a, b, c, q) > 0
+                           for q in coords if q is not a and q is not b and q is not c):
+                    break
+            # Create triangle with the ear (poly[j-1], poly[j], poly[j+1])
+            T = self.newTriangles(1)[0]
+            self.tris[T] = (poly[j-1], poly[j], poly[(j+1) % n])
+            self.neighbours[T] = -1
+            self.linkTriangles(T, 0, outer[j])
+            self.linkTriangles(T, 2, outer[j-1])
+            self.vertexTri[self.tris[T]] = T
+            self.updateCircles([T])
+            if n == 3:
+                self.linkTriangles(T, 1, outer[(j+1) % n])
+                self.lastTriangle = T
+                return T
+            # Replace the ear by its diagonal in the polygon
+            outer[j-1] = T
+            del poly[j], outer[j], coords[j]
+
+    def moveVertex(self, i, p):
+        """Move vertex i (index as in exportDT) to position p, and repair the
+        triangulation around it. Returns the number of edge flips done.
+        """
+        T = self.removeVertex(i)
+        self.coords[i + 4] = p
+        return self.insertVertexByFlips(i + 4, T)
+
+    def moveVertices(self, idx, points):
+        """Move a set of vertex (index as in exportDT) to new positions.
+        Returns the number of edge flips done.
+        """
+        return sum(self.moveVertex(i, p) for i, p in zip(idx.tolist(), points))
 
     def exportTriangles(self):
         """Export the current list of Delaunay triangles
         """
         # Filter out triangles with any vertex in the extended BBox
+        tris = self.tris[self.liveTriangles()]
         return [(a-4, b-4, c-4)
-                for (a, b, c) in self.triangles if a > 3 and b > 3 and c > 3]
+                for (a, b, c) in tris.tolist() if a > 3 and b > 3 and c > 3]
 
     def exportCircles(self):
         """Export the circumcircles as a list of (center, radius)
         """
-        # Remember to compute circumcircles if not done before
-        # for t in self.triangles:
-        #     self.circles[t] = self.circumcenter(t)
-
         # Filter out triangles with any vertex in the extended BBox
         # Do sqrt of radius before of return
-        return [(self.circles[(a, b, c)][0], sqrt(self.circles[(a, b, c)][1]))
-                for (a, b, c) in self.triangles if a > 3 and b > 3 and c > 3]
+        live = self.liveTriangles()
+        pts = self.coords[self.tris[live]]
+        keep = np.all(self.tris[live] > 3, axis=1)
+        centers, radii = circumcircles(pts[keep, 0], pts[keep, 1], pts[keep, 2])
+        return list(zip(centers, np.sqrt(radii).tolist()))
 
     def exportDT(self):
         """Export the current set of Delaunay coordinates and triangles.
         """
         # Filter out coordinates in the extended BBox
-        coord = self.coords[4:]
+        coord = self.coords[4:self.numCoords].copy()
 
         # Filter out triangles with any vertex in the extended BBox
-        tris = [(a-4, b-4, c-4)
-                for (a, b, c) in self.triangles if a > 3 and b > 3 and c > 3]
+        tris = self.exportTriangles()
         return coord, tris
 
     def exportExtendedDT(self):
         """Export the Extended Delaunay Triangulation (with the frame vertex).
         """
-        return self.coords, list(self.triangles)
+        tris = self.tris[self.liveTriangles()]
+        return self.coords[:self.numCoords].copy(), [tuple(t) for t in tris.tolist()]
         
+    def exportVoronoiCSR(self):
+        """Export coordinates and regions of Voronoi diagram as numpy arrays.
+        Returns the coordinates of the Voronoi vertex and the regions of the
+        vertex 4.. as a CSR pair: region i is indices[offsets[i]:offsets[i+1]]
+        """
+        # Use circumcenters of live triangles as Voronoi vertex, in slot order
+        live = self.liveTriangles()
+        pts = self.coords[self.tris[live]]
+        vor_coors = circumcircles(pts[:, 0], pts[:, 1], pts[:, 2])[0]
+        index = np.full(self.numTris, -1, dtype=np.int32)
+        index[live] = np.arange(len(live), dtype=np.int32)
+
+        offsets, indices = triangleStars(self.tris[:self.numTris], self.neighbours[:self.numTris],
+                                         self.vertexTri[4:self.numCoords], first=4)
+        return vor_coors, offsets, index[indices]
+
     def exportVoronoiRegions(self):
         """Export coordinates and regions of Voronoi diagram as indexed data.
         """
-        # Remember to compute circumcircles if not done before
-        # for t in self.triangles:
-        #     self.circles[t] = self.circumcenter(t)
-        useVertex = {i:[] for i in range(len(self.coords))}
-        vor_coors = []
-        index={}
-        # Build a list of coordinates and a index per triangle/region
-        for tidx, (a, b, c) in enumerate(sorted(self.triangles)):
-            vor_coors.append(self.circles[(a,b,c)][0])
-            # Insert triangle, rotating it so the key is the "last" vertex 
-            useVertex[a]+=[(b, c, a)]
-            useVertex[b]+=[(c, a, b)]
-            useVertex[c]+=[(a, b, c)]
-            # Set tidx as the index to use with this triangles
-            index[(a, b, c)] = tidx
-            index[(c, a, b)] = tidx
-            index[(b, c, a)] = tidx
-            
-        # init regions per coordinate dictionary
-        regions = {}
-        # Sort each region in a coherent order, and substitude each triangle
-        # by its index
-        for i in range (4, len(self.coords)):
-            v = useVertex[i][0][0]  # Get a vertex of a triangle
-            r=[]
-            for _ in range(len(useVertex[i])):
-                # Search the triangle beginning with vertex v
-                t = [t for t in useVertex[i] if t[0] == v][0]
-                r.append(index[t])  # Add the index of this triangle to region
-                v = t[1]            # Choose the next vertex to search
-            regions[i-4]=r          # Store region.
-            
+        vor_coors, offsets, indices = self.exportVoronoiCSR()
+        indices = indices.tolist()
+        regions = {i: indices[offsets[i]:offsets[i+1]] for i in range(len(offsets) - 1)}
+        return vor_coors, regions
+
+
+def triangleStars(tris, neighbours, vertexTri, first=0):
+    """Compute the star (CCW ring of incident triangles) of a set of vertex.
+    tris       -- Array (n x 3) with the vertex of each triangle in CCW order
+    neighbours -- Array (n x 3) with the triangle opposite to each vertex
+    vertexTri  -- One incident triangle of vertex first, first+1, ... (-1 to skip)
+    Returns a CSR pair: star of vertex first+i is indices[offsets[i]:offsets[i+1]]
+    Each star is walked in O(degree). Stars are expected to be closed.
+    """
+    tris = tris.tolist()
+    neighbours = neighbours.tolist()
+    offsets = [0]
+    indices = []
+    for v, t0 in enumerate(vertexTri.tolist(), first):
+        if t0 >= 0:
+            t = t0
+            while True:
+                indices.append(t)
+                # Go to next triangle around v, through the edge opposite to
+                # the vertex after v in CCW order
+                t = neighbours[t][(tris[t].index(v) + 1) % 3]
+                if t == t0:
+                    break
+        offsets.append(len(indices))
+    return np.array(offsets, dtype=np.int64), np.array(indices, dtype=np.int32)
+
+
+def cvtEnergy(seeds, area, centroid, inertia):
+    """Energy of a centroidal Voronoi tessellation: sum for all regions of the
+    integral of the squared distance to its seed. Uses the output of
+    regionMoments for the regions of the seeds.
+    ref: Du, Faber, Gunzburger "Centroidal Voronoi Tessellations" (1999)
+    """
+    return np.sum(inertia - 2 * area * (seeds * centroid).sum(axis=1) + area * (seeds * seeds).sum(axis=1))
+
+
+def nearPairs(points, radius):
+    """Find all pairs of points nearer than radius, using a spatial hash of
+    cells of side radius (so only neighbour cells need to be checked).
+    Returns two arrays i, j (with i < j) with the index of each pair.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape((-1, 2))
+    cells = np.floor(points / radius).astype(np.int64)
+    cells -= cells.min(axis=0, initial=0)
+    width = cells[:, 1].max(initial=0) + 3
+    keys = (cells[:, 0] + 1) * width + cells[:, 1] + 1
+    order = np.argsort(keys, kind='stable')
+    sortedKeys = keys[order]
+    pairs = []
+    # Check the same cell and half of the neighbour cells, so each pair is found once
+    for dx, dy in ((0, 0), (0, 1), (1, -1), (1, 0), (1, 1)):
+        lo = np.searchsorted(sortedKeys, keys + dx * width + dy, side='left')
+        hi = np.searchsorted(sortedKeys, keys + dx * width + dy, side='right')
+        counts = hi - lo
+        i = np.repeat(np.arange(len(points)), counts)
+        j = order[np.repeat(lo - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())]
+        if dx == dy == 0:
+            i, j = i[i < j], j[i < j]
+        pairs.append((i, j))
+    i = np.concatenate([p[0] for p in pairs])
+    j = np.concatenate([p[1] for p in pairs])
+    near = ((points[i] - points[j]) ** 2).sum(axis=1) < radius * radius
+    i, j = i[near], j[near]
+    return np.minimum(i, j), np.maximum(i, j)
+
+
+def remapRegions(offsets, indices, lookup):
+    """Change the vertex of a set of regions, given as a CSR pair, using an
+    old -> new lookup array, and remove consecutive repeated vertex in each
+    region (a region keeps one vertex at least).
+    Returns the new CSR pair (offsets, indices).
+    """
+    offsets = np.asarray(offsets)
+    indices = np.asarray(lookup)[indices]
+    # Index of the previous vertex in the same region
+    prev = np.arange(-1, len(indices) - 1)
+    prev[offsets[:-1]] = offsets[1:] - 1
+    keep = indices != indices[prev]
+    keep[offsets[:-1]] |= ~np.logical_or.reduceat(keep, offsets[:-1])
+    counts = np.add.reduceat(keep, offsets[:-1])
+    return np.concatenate(([0], np.cumsum(counts))), indices[keep]
+
+
+def halfEdges(offsets, indices):
+    """Build the half-edges of a set of regions, given as a CSR pair. The
+    twin of each half-edge (the same edge in the opposite direction, in a
+    neighbour region) is found with a sorted array of edge keys.
+    Returns arrays src, dst, region and twin (-1 for edges in the boundary).
+    """
+    offsets = np.asarray(offsets)
+    src = np.asarray(indices, dtype=np.int64)
+    # Index of the next vertex in the same region
+    nxt = np.arange(1, len(src) + 1)
+    nxt[offsets[1:] - 1] = offsets[:-1]
+    dst = src[nxt]
+    region = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    nv = src.max(initial=0) + 1
+    keys = src * nv + dst
+    order = np.argsort(keys, kind='stable')
+    twinKeys = dst * nv + src
+    pos = np.minimum(np.searchsorted(keys[order], twinKeys), len(src) - 1)
+    found = (keys[order][pos] == twinKeys) & (src != dst)
+    twin = np.where(found, order[pos], -1)
+    return src, dst, region, twin
+
+
+def unionFind(n, i, j):
+    """Join elements i[k] and j[k] of a set of n elements in clusters.
+    Returns the label of each element: the smallest element of its cluster.
+    ref: https://en.wikipedia.org/wiki/Disjoint-set_data_structure
+    """
+    parent = list(range(n))
+
+    def find(a):
+        while parent[a] != a:
+            parent[a] = parent[parent[a]]
+            a = parent[a]
+        return a
+
+    for a, b in zip(np.asarray(i).tolist(), np.asarray(j).tolist()):
+        a, b = find(a), find(b)
+        if a != b:
+            parent[max(a, b)] = min(a, b)
+    return np.array([find(a) for a in range(n)], dtype=np.int64)
+
+
+def relaxLBFGS(dt, seeds, movable, steps, tolerance=None, seedDistance=1.0, maxRadius=np.inf, memory=7):
+    """Move the seeds to minimize the energy of the centroidal Voronoi
+    tessellation with L-BFGS. The gradient of the energy for seed i is
+    2*A_i*(s_i - c_i), so the initial Hessian is the diagonal 2*A_i and the
+    first step is a full Lloyd step. Each evaluation of the energy needs to
+    rebuild the Voronoi diagram.
+    dt        -- Triangulation with the seeds (and barriers), as built by newTriangulation
+    seeds     -- Array (n x 2) of seeds. It is updated in place
+    movable   -- Index of the seeds to move. Other seeds and barriers are constraints
+    steps     -- Max number of iterations
+    tolerance -- Stop when the relative energy decrease, or the max displacement
+                 relative to seedDistance, is below tolerance
+    maxRadius -- Seeds are projected inside this distance to the origin
+    memory    -- Number of previous steps used to approximate the Hessian
+    Returns a dict with the energy, displacement, time and rebuilds of each iteration.
+    ref: Liu et al. "On centroidal Voronoi tessellation - energy smoothness
+         and fast computation" (2009)
+    """
+    n = len(seeds)
+
+    def evaluate(x):
+        # Energy and gradient for seeds moved to x. Returns the area of the regions too.
+        # The gradient is exact for the energy of all the regions (including barriers),
+        # so use it in the line search, but report the energy of the seeds regions
+        seeds[movable] = x
+        dt.moveVertices(movable, x)
+        vor_coors, offsets, indices = dt.exportVoronoiCSR()
+        area, centroid, inertia = regionMoments(vor_coors, offsets, indices)
+        allSeeds = dt.coords[4:len(area) + 4]
+        energy = cvtEnergy(allSeeds, area, centroid, inertia)
+        seedsEnergy = cvtEnergy(seeds, area[:n], centroid[:n], inertia[:n])
+        return energy, 2 * area[movable, None] * (x - centroid[movable]), area[movable], seedsEnergy
+
+    def project(x):
+        r = np.linalg.norm(x, axis=1)[:, None]
+        return np.where(r < maxRadius, x, x * (0.999 * maxRadius / np.maximum(r, 1e-12)))
+
+    relaxation = {'energy': [], 'displacement': [], 'time': [], 'rebuilds': []}
+    x = seeds[movable].copy()
+    energy, grad, area, seedsEnergy = evaluate(x)
+    rebuilds = 1
+    S, Y = [], []
+    for w in range(steps):
+        t0 = time.perf_counter()
+        # Two-loop recursion to compute the search direction
+        q = grad.copy()
+        alphas = []
+        for s, y in reversed(list(zip(S, Y))):
+            alphas.append((s * q).sum() / (y * s).sum())
+            q -= alphas[-1] * y
+        d = q / (2 * area[:, None])
+        for (s, y), a in zip(zip(S, Y), reversed(alphas)):
+            d += s * (a - (y * d).sum() / (y * s).sum())
+        d = -d
+        if (d * grad).sum() >= 0:
+            # Not a descent direction. Forget the history and use a Lloyd step
+            S, Y = [], []
+            d = -grad / (2 * area[:, None])
+        # Seeds at maxRadius can not move outwards (active constraints). Remove that component
+        r = np.linalg.norm(x, axis=1)
+        radial = (d * x).sum(axis=1) / np.maximum(r * r, 1e-12)
+        bound = (r >= 0.998 * maxRadius) & (radial > 0)
+        d[bound] -= radial[bound, None] * x[bound]
+        # Do not move any seed more than seedDistance in one step
+        step = min(1.0, seedDistance / np.linalg.norm(d, axis=1).max(initial=1e-12))
+
+        # Backtracking line search (Armijo condition)
+        for _ in range(10):
+            xNew = project(x + step * d)
+            energyNew, gradNew, areaNew, seedsEnergyNew = evaluate(xNew)
+            rebuilds += 1
+            if energyNew <= energy + 1e-4 * (grad * (xNew - x)).sum():
+                break
+            step *= 0.5
+        else:
+            # The line search failed. Move the seeds back to x, and retry with a Lloyd
+            # step (forget the history). Stop if it was a Lloyd step already
+            evaluate(x)
+            rebuilds += 1
+            print("L-BFGS Iteration", w + 1, "of", steps, "rebuilds:", rebuilds, "line search failed")
+            if not S:
+                break
+            S, Y = [], []
+            continue
+
+        s, y = xNew - x, gradNew - grad
+        if (s * y).sum() > 0:
+            S.append(s)
+            Y.append(y)
+            S, Y = S[-memory:], Y[-memory:]
+        displacement = np.linalg.norm(s, axis=1).max(initial=0)
+        energyDecrease = (energy - energyNew) / seedsEnergy
+        x, energy, grad, area, seedsEnergy = xNew, energyNew, gradNew, areaNew, seedsEnergyNew
+
+        relaxation['energy'].append(float(seedsEnergy))
+        relaxation['displacement'].append(float(displacement))
+        relaxation['time'].append(time.perf_counter() - t0)
+        relaxation['rebuilds'].append(rebuilds)
+        print("L-BFGS Iteration", w + 1, "of", steps, "rebuilds:", rebuilds, "energy: %g displacement: %g" % (
+            seedsEnergy, displacement))
+        if tolerance is not None and (energyDecrease < tolerance or displacement < tolerance * seedDistance):
+            print("L-BFGS converged after", w + 1, "iterations")
+            break
+    return relaxation
+
+
+class QuadEdgeMesh:
+    """
+    Quad-edge data structure to build a Delaunay triangulation in 2D with the
+    divide and conquer algorithm of Guibas and Stolfi, O(n log n) worst case.
+    ref: Guibas, Stolfi "Primitives for the manipulation of general
+         subdivisions and the computation of Voronoi diagrams" (1985)
+    ref: http://www.cs.cmu.edu/afs/andrew/scs/cs/15-463/2001/pub/src/a2/quadedge.html
+
+    Edges are stored in flat lists. The quad-edge q is made of the edges
+    4q (primal), 4q+1 (dual), 4q+2 (primal, reversed) and 4q+3 (dual, reversed)
+      org[e] -- The origin vertex of e (-1 for dual or deleted edges)
+      nxt[e] -- The next edge CCW with the same origin (Onext)
+    """
+
+    def __init__(self, coords, predicates=None):
+        """ Create an empty mesh
+        coords -- Coordinates of the vertex (indexed by vertex id)
+        predicates -- Optional Predicates object used to test the points
+        """
+        self.coords = np.asarray(coords, dtype=np.float64).tolist()
+        self.predicates = predicates or Predicates()
+        self.org = []
+        self.nxt = []
+
+    def makeEdge(self, a, b):
+        """Create a new isolated edge from vertex a to vertex b
+        """
+        e = len(self.nxt)
+        self.nxt += [e, e + 3, e + 2, e + 1]
+        self.org += [a, -1, b, -1]
+        return e
+
+    def splice(self, a, b):
+        """Join or split the rings of edges around the origins of a and b
+        """
+        nxt = self.nxt
+        alpha = (nxt[a] & ~3) | ((nxt[a] + 1) & 3)
+        beta = (nxt[b] & ~3) | ((nxt[b] + 1) & 3)
+        nxt[a], nxt[b] = nxt[b], nxt[a]
+        nxt[alpha], nxt[beta] = nxt[beta], nxt[alpha]
+
+    def lnext(self, e):
+        """Next edge CCW around the face at the left of e
+        """
+        r = self.nxt[(e & ~3) | ((e + 3) & 3)]
+        return (r & ~3) | ((r + 1) & 3)
+
+    def oprev(self, e):
+        """Next edge CW with the same origin
+        """
+        r = self.nxt[(e & ~3) | ((e + 1) & 3)]
+        return (r & ~3) | ((r + 1) & 3)
+
+    def connect(self, a, b):
+        """Add a new edge from the destination of a to the origin of b, so
+        a, e and b share the same left face
+        """
+        e = self.makeEdge(self.org[a ^ 2], self.org[b])
+        self.splice(e, self.lnext(a))
+        self.splice(e ^ 2, b)
+        return e
+
+    def deleteEdge(self, e):
+        """Disconnect the edge e from the rest of the mesh
+        """
+        self.splice(e, self.oprev(e))
+        self.splice(e ^ 2, self.oprev(e ^ 2))
+        self.org[e] = self.org[e ^ 2] = -1
+
+    def append(self, org, nxt):
+        """Append the edges of other mesh (its org and nxt lists), so they
+        can be merged with the edges of this mesh. Returns the offset added
+        to the edges of the other mesh.
+        """
+        offset = len(self.nxt)
+        self.org += org
+        self.nxt += [e + offset for e in nxt]
+        return offset
+
+    def triangulate(self, vertex):
+        """Build the Delaunay triangulation of a list of vertex ids, sorted by
+        its coordinates (x, then y). Duplicated points are not allowed.
+        Returns the CCW convex hull edge out of the leftmost vertex and the CW
+        convex hull edge out of the rightmost vertex.
+        """
+        n = len(vertex)
+        ccw = self.predicates.orient2d
+        if n == 2:
+            a = self.makeEdge(vertex[0], vertex[1])
+            return a, a ^ 2
+        if n == 3:
+            p1, p2, p3 = (self.coords[v] for v in vertex)
+            a = self.makeEdge(vertex[0], vertex[1])
+            b = self.makeEdge(vertex[1], vertex[2])
+            self.splice(a ^ 2, b)
+            # Close the triangle (if not collinear)
+            if ccw(p1, p2, p3) > 0:
+                self.connect(b, a)
+                return a, b ^ 2
+            elif ccw(p1, p3, p2) > 0:
+                c = self.connect(b, a)
+                return c ^ 2, c
+            return a, b ^ 2
+        ldo, ldi = self.triangulate(vertex[:n // 2])
+        rdi, rdo = self.triangulate(vertex[n // 2:])
+        return self.merge(ldo, ldi, rdi, rdo)
+
+    def merge(self, ldo, ldi, rdi, rdo):
+        """Merge two triangulations separated by a vertical line.
+        ldo, ldi -- Hull edges of the left triangulation (see triangulate)
+        rdi, rdo -- Hull edges of the right triangulation (see triangulate)
+        Returns the hull edges of the merged triangulation.
+        """
+        org, nxt, coords = self.org, self.nxt, self.coords
+        ccw = self.predicates.orient2d
+        inCircle = self.predicates.inCircle
+        oprev = self.oprev
+
+        # Compute the lower common tangent of left and right triangulations
+        while True:
+            if ccw(coords[org[rdi]], coords[org[ldi]], coords[org[ldi ^ 2]]) > 0:
+                ldi = self.lnext(ldi)
+            elif ccw(coords[org[ldi]], coords[org[rdi ^ 2]], coords[org[rdi]]) > 0:
+                rdi = nxt[rdi ^ 2]
+            else:
+                break
+
+        # Create the first cross edge (basel) from rdi.Org to ldi.Org
+        basel = self.connect(rdi ^ 2, ldi)
+        if org[ldi] == org[ldo]:
+            ldo = basel ^ 2
+        if org[rdi] == org[rdo]:
+            rdo = basel
+
+        # Merge loop: add cross edges from bottom to top
+        while True:
+            bo, bd = coords[org[basel]], coords[org[basel ^ 2]]
+            # Locate the first left point to be encountered by the rising bubble,
+            # and delete left edges out of basel.Dest that fail the circle test.
+            lcand = nxt[basel ^ 2]
+            lvalid = ccw(coords[org[lcand ^ 2]], bd, bo) > 0
+            if lvalid:
+                while inCircle(bd, bo, coords[org[lcand ^ 2]], coords[org[nxt[lcand] ^ 2]]) > 0:
+                    t = nxt[lcand]
+                    self.deleteEdge(lcand)
+                    lcand = t
+            # Same for the right side
+            rcand = oprev(basel)
+            rvalid = ccw(coords[org[rcand ^ 2]], bd, bo) > 0
+            if rvalid:
+                while inCircle(bd, bo, coords[org[rcand ^ 2]], coords[org[oprev(rcand) ^ 2]]) > 0:
+                    t = oprev(rcand)
+                    self.deleteEdge(rcand)
+                    rcand = t
+            # If both are invalid, basel is the upper common tangent
+            if not lvalid and not rvalid:
+                return ldo, rdo
+            # The next cross edge is to be connected to either lcand.Dest or rcand.Dest
+            if not lvalid or (rvalid and inCircle(coords[org[lcand ^ 2]], coords[org[lcand]],
+                                                  coords[org[rcand]], coords[org[rcand ^ 2]]) > 0):
+                basel = self.connect(rcand, basel ^ 2)
+            else:
+                basel = self.connect(basel ^ 2, lcand ^ 2)
+
+    def exportTriangles(self):
+        """Export the triangles of the mesh (the faces with three edges and CCW
+        orientation) and the neighbour opposite to each of its vertex.
+        """
+        nxt = np.array(self.nxt, dtype=np.int64)
+        org = np.array(self.org, dtype=np.int64)
+        # Compute Lnext for every edge: Rot(Onext(InvRot(e)))
+        r = nxt[(np.arange(len(nxt)) & ~3) | ((np.arange(len(nxt)) + 3) & 3)]
+        lnext = (r & ~3) | ((r + 1) & 3)
+
+        # Choose the faces with 3 edges, each one from its smallest edge
+        e = np.flatnonzero(org >= 0)
+        e1 = lnext[e]
+        e2 = lnext[e1]
+        face = (lnext[e2] == e) & (e < e1) & (e < e2)
+        e, e1, e2 = e[face], e1[face], e2[face]
+        coords = np.asarray(self.coords)
+        a, b, c = coords[org[e]], coords[org[e1]], coords[org[e2]]
+        u, v = b - a, c - a
+        face = u[:, 0] * v[:, 1] - u[:, 1] * v[:, 0] > 0
+        e, e1, e2 = e[face], e1[face], e2[face]
+
+        # Index the triangle at the left of each edge
+        faceOf = np.full(len(nxt), -1, dtype=np.int64)
+        ids = np.arange(len(e))
+        faceOf[e], faceOf[e1], faceOf[e2] = ids, ids, ids
+        tris = np.column_stack((org[e], org[e1], org[e2])).astype(np.int32)
+        neighbours = np.column_stack((faceOf[e1 ^ 2], faceOf[e2 ^ 2], faceOf[e ^ 2])).astype(np.int32)
+        return tris, neighbours
+
+
+class DivideConquerDelaunay2D(Delaunay2D):
+    """
+    Delaunay2D that builds the triangulation with the divide and conquer
+    algorithm of Guibas and Stolfi when the points are inserted all at once
+    in an empty triangulation. This does not depend on insertion order.
+    Later changes (addPoint, moveVertex...) are done with Delaunay2D methods.
+    """
+
+    def addPoints(self, points, order=None, randomSeed=0):
+        """Add a set of points to the current DT.
+        See Delaunay2D.addPoints. order and randomSeed are only used when the
+        triangulation is not empty.
+        """
+        if self.numCoords > 4:
+            return Delaunay2D.addPoints(self, points, order, randomSeed)
+        points = np.asarray(points, dtype=np.float64).reshape((-1, 2))
+        self.reserve(4 + len(points))
+        self.coords[4:4 + len(points)] = points
+        self.numCoords = 4 + len(points)
+
+        # Triangulate the frame and the points, sorted by x and y
+        coords = self.coords[:self.numCoords]
+        mesh = QuadEdgeMesh(coords, self.predicates)
+        mesh.triangulate(np.lexsort((coords[:, 1], coords[:, 0])).tolist())
+        self.setTriangles(*mesh.exportTriangles())
+
+
+def triangulateStrip(points, vertex):
+    """Triangulate a strip of points with divide and conquer. Used by the
+    worker processes of ParallelDelaunay2D.
+    points -- Coordinates of the points, sorted by x and y
+    vertex -- The vertex id of each point
+    Returns the org and nxt lists of the QuadEdgeMesh (using vertex ids) and
+    its ldo and rdo hull edges.
+    """
+    mesh = QuadEdgeMesh(points)
+    ldo, rdo = mesh.triangulate(list(range(len(points))))
+    org = [vertex[o] if o >= 0 else -1 for o in mesh.org]
+    return org, mesh.nxt, ldo, rdo
+
+
+class ParallelDelaunay2D(DivideConquerDelaunay2D):
+    """
+    DivideConquerDelaunay2D that splits the points in vertical strips, and
+    triangulates each strip in a different process. The strips are merged
+    along their seams with the merge step of the divide and conquer.
+    """
+
+    def __init__(self, center=(0, 0), radius=9999, workers=None, minStripSize=1000, **kwargs):
+        """ Init and create a new frame to contain the triangulation
+        workers -- Number of processes to use. Default: os.cpu_count()
+        minStripSize -- Min number of points per strip (use less strips if needed)
+        See Delaunay2D for other arguments.
+        """
+        DivideConquerDelaunay2D.__init__(self, center, radius, **kwargs)
+        self.workers = workers or os.cpu_count()
+        self.minStripSize = minStripSize
+
+    def addPoints(self, points, order=None, randomSeed=0):
+        """Add a set of points to the current DT.
+        See DivideConquerDelaunay2D.addPoints.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape((-1, 2))
+        numStrips = min(self.workers, (len(points) + 4) // self.minStripSize)
+        if self.numCoords > 4 or numStrips < 2:
+            return DivideConquerDelaunay2D.addPoints(self, points, order, randomSeed)
+        self.reserve(4 + len(points))
+        self.coords[4:4 + len(points)] = points
+        self.numCoords = 4 + len(points)
+
+        # Split the frame and the points, sorted by x and y, in strips
+        coords = self.coords[:self.numCoords]
+        vertex = np.lexsort((coords[:, 1], coords[:, 0]))
+        strips = np.array_split(vertex, numStrips)
+        with ProcessPoolExecutor(numStrips) as executor:
+            results = list(executor.map(triangulateStrip, [coords[s] for s in strips],
+                                        [s.tolist() for s in strips]))
+
+        # Join all the strips in the same mesh, and merge them by pairs
+        mesh = QuadEdgeMesh(coords, self.predicates)
+        hulls = []
+        for org, nxt, ldo, rdo in results:
+            offset = mesh.append(org, nxt)
+            hulls.append((ldo + offset, rdo + offset))
+        while len(hulls) > 1:
+            merged = [mesh.merge(*hulls[i], *hulls[i+1]) for i in range(0, len(hulls) - 1, 2)]
+            hulls = merged + hulls[len(merged) * 2:]
+        self.setTriangles(*mesh.exportTriangles())
+
+
+class QhullDelaunay2D:
+    """
+    Delaunay triangulation in 2D computed with scipy.spatial.Delaunay (Qhull).
+    Same interface and output than Delaunay2D, including the four corners of
+    the frame as the first vertex. The points are stored, and the compiled
+    triangulation is only rebuilt when its data is exported.
+    """
+
+    def __init__(self, center=(0, 0), radius=9999):
+        """ Init and create a new frame to contain the triangulation
+        center -- Optional position for the center of the frame. Default (0,0)
+        radius -- Optional distance from corners to the center.
+        """
+        if QhullDelaunay is None:
+            raise ImportError("QhullDelaunay2D needs the scipy package")
+        center = np.asarray(center)
+        self.coords = center + radius * np.array(((-1, -1), (+1, -1), (+1, +1), (-1, +1)), dtype=np.float64)
+        self.triangulation = None
+
+    def addPoint(self, p):
+        """Add a point to the current DT.
+        """
+        self.addPoints([p])
+
+    def addPoints(self, points):
+        """Add a set of points to the current DT.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape((-1, 2))
+        self.coords = np.concatenate((self.coords, points))
+        self.triangulation = None
+
+    def moveVertex(self, i, p):
+        """Move vertex i (index as in exportDT) to position p. The triangulation
+        will be rebuilt on next export, so it always returns 0 flips.
+        """
+        self.coords[i + 4] = p
+        self.triangulation = None
+        return 0
+
+    def moveVertices(self, idx, points):
+        """Move a set of vertex (index as in exportDT) to new positions.
+        See moveVertex.
+        """
+        self.coords[np.asarray(idx) + 4] = points
+        self.triangulation = None
+        return 0
+
+    def triangulate(self):
+        """Compute (if needed) the triangulation. Returns the triangles in CCW
+        order, its neighbours and an incident triangle for each vertex.
+        """
+        if self.triangulation is None:
+            dt = QhullDelaunay(self.coords)
+            tris = dt.simplices.astype(np.int32)
+            neighbours = dt.neighbors.astype(np.int32)
+            # Qhull does not sort the vertex. Swap two of them in CW triangles
+            a, b, c = (self.coords[tris[:, i]] for i in range(3))
+            u, v = b - a, c - a
+            cw = u[:, 0] * v[:, 1] - u[:, 1] * v[:, 0] < 0
+            tris[cw] = tris[cw][:, [0, 2, 1]]
+            neighbours[cw] = neighbours[cw][:, [0, 2, 1]]
+            self.triangulation = tris, neighbours, dt.vertex_to_simplex.astype(np.int32)
+        return self.triangulation
+
+    def exportTriangles(self):
+        """Export the current list of Delaunay triangles
+        """
+        # Filter out triangles with any vertex in the extended BBox
+        tris = self.triangulate()[0]
+        return [(a-4, b-4, c-4)
+                for (a, b, c) in tris.tolist() if a > 3 and b > 3 and c > 3]
+
+    def exportDT(self):
+        """Export the current set of Delaunay coordinates and triangles.
+        """
+        return self.coords[4:].copy(), self.exportTriangles()
+
+    def exportVoronoiCSR(self):
+        """Export coordinates and regions of Voronoi diagram as numpy arrays.
+        See Delaunay2D.exportVoronoiCSR
+        """
+        tris, neighbours, vertexTri = self.triangulate()
+        pts = self.coords[tris]
+        vor_coors = circumcircles(pts[:, 0], pts[:, 1], pts[:, 2])[0]
+        offsets, indices = triangleStars(tris, neighbours, vertexTri[4:], first=4)
+        return vor_coors, offsets, indices
+
+    def exportVoronoiRegions(self):
+        """Export coordinates and regions of Voronoi diagram as indexed data.
+        """
+        vor_coors, offsets, indices = self.exportVoronoiCSR()
+        indices = indices.tolist()
+        regions = {i: indices[offsets[i]:offsets[i+1]] for i in range(len(offsets) - 1)}
         return vor_coors, regions
 
 
+# Available backends to compute Delaunay triangulations
+triangulationBackends = {'python': Delaunay2D, 'dc': DivideConquerDelaunay2D,
+                         'parallel': ParallelDelaunay2D, 'scipy': QhullDelaunay2D}
+
+
+def newTriangulation(backend='python', center=(0, 0), radius=9999):
+    """Create a new empty triangulation using the given backend.
+    backend -- 'python' (incremental, the default), 'dc' (divide and conquer),
+               'parallel' (divide and conquer using all cores), 'scipy' or
+               'auto' (use scipy if available)
+    Every backend supports addPoint(), addPoints(), moveVertex(), exportDT(),
+    exportVoronoiCSR() and exportVoronoiRegions().
+    """
+    if backend == 'auto':
+        backend = 'python' if QhullDelaunay is None else 'scipy'
+    return triangulationBackends[backend](center=center, radius=radius)
+
+
+def indexType(maxValue):
+    """Smallest integer type (int16 or int32) able to store indices up to maxValue
+    """
+    return np.int16 if maxValue <= np.iinfo(np.int16).max else np.int32
+
+
+def jsonArray(obj):
+    """Convert numpy arrays and scalars to python objects, for json.dump
+    float32 values are written with the shortest text that gives the same float32
+    """
+    if isinstance(obj, (np.ndarray, np.generic)):
+        if obj.dtype == np.float32:
+            return np.asarray(obj).astype(str).astype(np.float64).tolist()
+        return obj.tolist()
+    if isinstance(obj, RegionList):
+        offsets, values = obj.csr()
+        values = jsonArray(values)
+        return [values[offsets[r]:offsets[r+1]] for r in range(len(obj))]
+    raise TypeError("Object of type %s is not JSON serializable" % type(obj).__name__)
+
+
+def writeJSON(data, f, chunkSize=1 << 16):
+    """Write a dict as JSON, with sorted keys, streaming the big arrays (and
+    RegionList) by chunks of rows, so they are never converted to a whole python list.
+    """
+    f.write('{')
+    for n, key in enumerate(sorted(data)):
+        value = data[key]
+        f.write('%s%s:' % (',' if n else '', json.dumps(key)))
+        size = np.size(value.indices if isinstance(value, RegionList) else value) \
+            if isinstance(value, (np.ndarray, RegionList)) else 0
+        if size > chunkSize:
+            f.write('[')
+            step = max(1, chunkSize * len(value) // size)
+            for a in range(0, len(value), step):
+                f.write(('%s%s' % (',' if a else '', json.dumps(jsonArray(value[a:a+step]))[1:-1])))
+            f.write(']')
+        else:
+            json.dump(value, f, separators=(',', ':'), sort_keys=True, default=jsonArray)
+    f.write('}')
+
+
+def peakMemory():
+    """Peak resident set size (RSS) of this process, in MB. None if unknown
+    ref: https://docs.python.org/3/library/resource.html#resource.getrusage
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is given in bytes by macOS, and in KB by linux
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+class WorkDir:
+    """Storage for the big arrays of a CityData. Given a path, the arrays are
+    np.memmap backed .npy files in that folder (out-of-core mode), so the
+    stages can stream over them by chunks. Without path, they are plain numpy arrays.
+    Only the arrays created here are out of core: the triangulation, relaxation,
+    vertex merge (nearPairs, unionFind) and halfEdges work on in-memory arrays.
+    """
+
+    def __init__(self, path=None, chunkSize=1 << 16):
+        self.path = path
+        self.chunkSize = chunkSize
+        if path:
+            os.makedirs(path, exist_ok=True)
+
+    def empty(self, name, shape, dtype=np.float64):
+        """New (uninitialised) array, stored as name.npy in out-of-core mode
+        """
+        if not self.path:
+            return np.empty(shape, dtype=dtype)
+        return np.lib.format.open_memmap(os.path.join(self.path, name + '.npy'), mode='w+', dtype=dtype,
+                                         shape=tuple(np.atleast_1d(shape)))
+
+    def store(self, name, values, dtype=None):
+        """Copy an array (by chunks of rows) to a new array
+        """
+        result = self.empty(name, np.shape(values), dtype or values.dtype)
+        for a, b in self.chunks(len(values), int(np.prod(np.shape(values)[1:]))):
+            result[a:b] = values[a:b]
+        return result
+
+    def chunks(self, n, rowSize=1):
+        """Ranges (a, b) to iterate over n rows (of rowSize values) by chunks
+        """
+        step = max(1, self.chunkSize // rowSize)
+        for a in range(0, n, step):
+            yield a, min(a + step, n)
+
+    def regionChunks(self, offsets):
+        """Ranges (r0, r1) to iterate over the regions of a CSR pair, by chunks
+        of about chunkSize indices (one region at least)
+        """
+        numRegions = len(offsets) - 1
+        r0 = 0
+        while r0 < numRegions:
+            r1 = np.searchsorted(offsets, offsets[r0] + self.chunkSize, side='right') - 1
+            r1 = min(max(r1, r0 + 1), numRegions)
+            yield r0, r1
+            r0 = r1
+
+    def report(self, stage):
+        """Print the peak memory after a stage (in out-of-core mode)
+        """
+        if self.path and resource is not None:
+            print("Peak memory after %s: %.1f MB" % (stage, peakMemory()))
+
 
 class CityData(dict):
     """
@@ -258,9 +1705,23 @@ class CityData(dict):
         args.cityRadius -- Approximated radius of the city
         args.numBarriers -- Number of barrier seeds. Usually 12.
         args.LloydSteps -- Number of Lloyd's relaxation steps to apply 
+        args.LloydTolerance -- Run Lloyd's relaxation until the energy decrease or the
+                           seed displacement are below tolerance (instead of LloydSteps)
+        args.LloydMaxSteps -- Max number of Lloyd's relaxation steps if LloydTolerance is used
+        args.relax      -- Method to relax the seeds: 'lloyd' or 'lbfgs' (quasi-Newton)
+        args.curbDistance -- Distance from streets to curbs in each region. Default 1.0
+        args.houseDistance -- Distance from streets to houses in each region. Default 2.5
         args.gateLen    -- Size of the gates in the external wall. Use 0.0 to avoid place gates
         args.randomSeed -- Random seed (to make deterministic)
         args.debugSVG   -- Create debug SVG files on each step.
+        args.backend    -- Backend used to compute the Delaunay triangulation. Default 'python'
+        args.seeding    -- Method to place the non-fixed seeds: 'random', 'bridson' or 'tiles'
+        args.compact    -- Store coordinates as float32, and indices as int16/int32 (when they fit).
+                           All the computations are done in float64, so the regions are the same.
+        args.outOfCore  -- Folder to keep the big arrays (regions, region lines, metrics...) as
+                           memory mapped files, processed by chunks. Use None to keep them in memory.
+                           It does not bound the peak memory: triangulation, relaxation, vertex merge,
+                           halfEdges and region adjacency still work on whole in-memory arrays
         """
 
         def pnt2line(pnt, s1, s2):
@@ -301,6 +1762,9 @@ class CityData(dict):
         randomSeed = args.randomSeed
         debugSVG = args.debug
         debugSVG = args.debug
+        # Out-of-core mode: keep the big arrays as memory mapped files in a working directory
+        work = WorkDir(getattr(args, 'outOfCore', None))
+        self.work = work
         
         print("createNewScene (numSeeds=%d, cityRadius=%g, numBarriers=%d, LloydSteps=%d" % (
         numSeeds, cityRadius, numBarriers, LloydSteps))
@@ -326,6 +1790,8 @@ class CityData(dict):
         numFixedSeeds = 0
         staticRegions = {}
 
+        # Static regions are placed in the square [-cityRadius/2, cityRadius]^2
+        placer = RegionPlacer(-cityRadius / 2, cityRadius)
         for name in args.models:
             # Load relative seeds from "cg-XXXXXXX.json" file
             with open("cg-" + name + ".json", 'r') as f:
@@ -333,16 +1799,22 @@ class CityData(dict):
                 # Compute the radius of this set of seeds
                 radius = minSeedDistance/2 + max([np.linalg.norm(x) for x in regionSeeds])
                 # print("Read file cg-" + name + ".json", " -> radius",radius)
+                if numFixedSeeds + len(regionSeeds) > numSeeds:
+                    print(" * Skip", name, ": needs", len(regionSeeds), "seeds, but only",
+                          numSeeds - numFixedSeeds, "are available")
+                    continue
 
                 #Find a position in plane with no previous seeds nearest than radius
                 pos = np.asarray([0.0, 0.0])
                 if len(staticRegions) > 0:
-                    # Compute distances from point pos to center of previous regions
-                    # print("previous fixed regions", [r[2] for r in staticRegions.values()])
-                    # r[2] is position of fixedRegion. r[1] is radius of fixedRegion
-                    while (min([np.linalg.norm(r[2] - pos) - r[1] for r in staticRegions.values()]) < radius):
-                        # print("Invalid pos. Repeat...")
-                        pos = (1.5 * cityRadius * np.random.random(2) - cityRadius / 2).round(2)
+                    try:
+                        pos = placer.place(radius)
+                    except ValueError as e:
+                        # Shrink the layout, instead of looping for ever
+                        print(" * Skip", name, ":", e)
+                        continue
+                else:
+                    placer.add(pos, radius)
 
                 # Displace regionSeeds to pos and store it into the static seeds list
                 seeds[numFixedSeeds:numFixedSeeds+len(regionSeeds)] = regionSeeds + pos
@@ -352,14 +1824,28 @@ class CityData(dict):
                 staticRegions[numFixedSeeds] = [name, radius, pos]
                 numFixedSeeds += len(regionSeeds)        
             
-        # TODO: Try a method to create points not relaying in while(random) 
-        # Generate the non-fixed seeds and check none is too near of previous seeds
-        for i in range(numFixedSeeds, numSeeds):
-            # Check minimun distance from seed[i] to previous seeds
-            while(min(np.linalg.norm(seeds[0:i]-seeds[i], axis=1)) < minSeedDistance):
-                #print("Seed",  i, "is too near of previous seeds.")
-                # Generate a new position for seed[i] and repeat the check
-                seeds[i] = 2 * cityRadius * np.random.random(2) - cityRadius                                           
+        seeding = getattr(args, 'seeding', 'random')
+        if seeding in ('bridson', 'tiles'):
+            # Generate the non-fixed seeds with Poisson-disk sampling, around the fixed seeds.
+            # Use the largest distance that fits numSeeds in the square (up to minSeedDistance)
+            sampler = poissonDiskSeeds if seeding == 'bridson' else tiledSeeds
+            seedDistance = min(minSeedDistance, poissonDiskDistance(numSeeds, cityRadius))
+            print("Poisson-disk seedDistance = ", seedDistance)
+            newSeeds = sampler(numSeeds - numFixedSeeds, cityRadius, seedDistance, seeds[:numFixedSeeds])
+            while len(newSeeds) < numSeeds - numFixedSeeds:
+                # Last resort: a sparse sample (or fixed seeds taking much room). Reduce the distance
+                seedDistance *= min(0.95, sqrt(len(newSeeds) / (numSeeds - numFixedSeeds)))
+                print("Warning: only", len(newSeeds), "seeds fit. Using seedDistance", seedDistance)
+                newSeeds = sampler(numSeeds - numFixedSeeds, cityRadius, seedDistance, seeds[:numFixedSeeds])
+            seeds[numFixedSeeds:] = newSeeds
+        else:
+            # Generate the non-fixed seeds and check none is too near of previous seeds
+            for i in range(numFixedSeeds, numSeeds):
+                # Check minimun distance from seed[i] to previous seeds
+                while(min(np.linalg.norm(seeds[0:i]-seeds[i], axis=1)) < minSeedDistance):
+                    #print("Seed",  i, "is too near of previous seeds.")
+                    # Generate a new position for seed[i] and repeat the check
+                    seeds[i] = 2 * cityRadius * np.random.random(2) - cityRadius
 
         # Create a dense barrier of points around the seeds, to avoid far voronoi vertex
         if numBarriers > 0:
@@ -374,18 +1860,20 @@ class CityData(dict):
         DistanciaMaxima = 0.7 * DistanciaMaxima
 
         # Compute initial Voronoi Diagram
-        dt = Delaunay2D(radius = 10 * cityRadius)
+        dt = newTriangulation(getattr(args, 'backend', 'python'), radius = 10 * cityRadius)
+        print("Using triangulation backend", type(dt).__name__)
         
-        # Insert all seeds and barriers one by one
-        for s in barrierSeeds:
-            dt.addPoint(s)
-            
-        # Get the voronoi regions
-        vor_vertices, vor_regions = dt.exportVoronoiRegions()
-        internalRegions = [vor_regions[r] for r in range(len(seeds))]
+        # Insert all seeds and barriers at once
+        dt.addPoints(barrierSeeds)
+        if isinstance(dt, Delaunay2D):
+            print("Delaunay predicates:", dt.predicates.counters)
+
+        work.report("triangulation")
 
         # Plot initial voronoi diagram
         if debugSVG:
+            vor_vertices, vor_regions = dt.exportVoronoiRegions()
+            internalRegions = [vor_regions[r] for r in range(len(seeds))]
             #plotVoronoiData(vor_vertices, [], seeds, 'tmp0.1.seeds', cityRadius)
             #plotVoronoiData(vor_vertices, [], barrierSeeds, 'tmp0.2.barrierSeeds', cityRadius)
             plotVoronoiData(vor_vertices, internalRegions, barrierSeeds, 'tmp0.initialVoronoi', cityRadius)
@@ -393,99 +1881,122 @@ class CityData(dict):
         ###########################################################        
         # Apply several steps of Lloyd's Relaxation to non-fixed regions
         # See: https://en.wikipedia.org/wiki/Lloyd's_algorithm
+        # Run LloydSteps, or until the energy or the displacement of the seeds are below LloydTolerance
+        LloydTolerance = getattr(args, 'LloydTolerance', None)
+        if LloydTolerance is not None:
+            LloydSteps = getattr(args, 'LloydMaxSteps', 100)
+        relaxation = {'energy': [], 'displacement': [], 'time': [], 'rebuilds': []}
+        movable = np.arange(numFixedSeeds, len(seeds))
+        if getattr(args, 'relax', 'lloyd') == 'lbfgs':
+            # Use a quasi-Newton optimizer instead. Each step needs less rebuilds of the diagram
+            relaxation = relaxLBFGS(dt, seeds, movable, LloydSteps, LloydTolerance, minSeedDistance,
+                                    DistanciaMaxima)
+            LloydSteps = 0
+        n = len(seeds)
+        if LloydSteps:
+            # Compute the centroid of all regions, and the energy of the seed regions and of all regions.
+            # Only the energy of all regions (including barriers) decreases on each step
+            vor_coors, offsets, indices = dt.exportVoronoiCSR()
+            area, centroids, inertia = regionMoments(vor_coors, offsets, indices)
+            totalEnergy = cvtEnergy(np.concatenate((seeds, barrier)), area, centroids, inertia)
         for w in range(LloydSteps):
-            print("Lloyd Iteration", w + 1, "of", LloydSteps)
-            for r in range(numFixedSeeds, len(internalRegions)):
-                # Compute the center of the region
-                centroid = np.average([vor_vertices[i] for i in internalRegions[r]], axis=0)
-
-                # Relax the seed for this region
-                newSeed = np.array(0.5 * (seeds[r] + centroid))
-                dist = np.linalg.norm(newSeed)
-                if dist < DistanciaMaxima:
-                    seeds[r] = newSeed
-                else:
-                    print("dist=", dist, ">= DistanciaMaxima=", DistanciaMaxima)
+            t0 = time.perf_counter()
+            # Relax the seeds of non-fixed regions, but keep them inside DistanciaMaxima
+            newSeeds = 0.5 * (seeds[movable] + centroids[movable])
+            inside = np.linalg.norm(newSeeds, axis=1) < DistanciaMaxima
+            if not inside.all():
+                print("  Seeds", movable[~inside], "beyond DistanciaMaxima=", DistanciaMaxima)
+            displacement = np.linalg.norm(newSeeds[inside] - seeds[movable[inside]], axis=1).max(initial=0)
+            seeds[movable[inside]] = newSeeds[inside]
+            # Move the seeds in the triangulation, instead of rebuild it
+            flips = dt.moveVertices(movable[inside], newSeeds[inside])
+
+            # Compute the centroids and the energy after the move
+            vor_coors, offsets, indices = dt.exportVoronoiCSR()
+            area, centroids, inertia = regionMoments(vor_coors, offsets, indices)
+            energy = cvtEnergy(seeds, area[:n], centroids[:n], inertia[:n])
+            previousEnergy = totalEnergy
+            totalEnergy = cvtEnergy(np.concatenate((seeds, barrier)), area, centroids, inertia)
+
+            relaxation['energy'].append(float(energy))
+            relaxation['displacement'].append(float(displacement))
+            relaxation['time'].append(time.perf_counter() - t0)
+            relaxation['rebuilds'].append(w + 2)
+            print("Lloyd Iteration", w + 1, "of", LloydSteps, "flips:", flips, "energy: %g displacement: %g" % (
+                energy, displacement))
 
-            # Recompute Voronoi Diagram
-            barrierSeeds = np.concatenate((seeds, barrier), axis=0)
-            dt = Delaunay2D(radius = 10 * cityRadius)
-            for s in barrierSeeds:
-                dt.addPoint(s)
-            vor_vertices, vor_regions = dt.exportVoronoiRegions()
-            internalRegions = [vor_regions[r] for r in range(len(seeds))]
-
-            # Plot initial voronoi diagram
             if debugSVG:
+                barrierSeeds = np.concatenate((seeds, barrier), axis=0)
+                vor_vertices, vor_regions = dt.exportVoronoiRegions()
+                internalRegions = [vor_regions[r] for r in range(len(seeds))]
                 plotVoronoiData(vor_vertices, internalRegions, barrierSeeds, 'tmp1.Lloyd-Step%d' % (w + 1), cityRadius)
+
+            if LloydTolerance is not None:
+                # Decrease of the energy of all regions (relative to the energy of the seed regions),
+                # or displacement relative to minSeedDistance
+                energyDecrease = (previousEnergy - totalEnergy) / energy
+                if energyDecrease < LloydTolerance or displacement < LloydTolerance * minSeedDistance:
+                    print("Lloyd converged after", w + 1, "iterations")
+                    break
+
+        # Recompute Voronoi Diagram. Keep the regions as a CSR pair too
+        barrierSeeds = np.concatenate((seeds, barrier), axis=0)
+        vor_vertices, vor_offsets, vor_indices = dt.exportVoronoiCSR()
+        if work.path:
+            # The triangulation is not needed anymore. Move the regions to the working directory
+            del dt
+            vor_offsets = work.store('voronoi_offsets', vor_offsets)
+            vor_indices = work.store('voronoi_indices', vor_indices)
+            work.report("relaxation")
+        vor_regions = RegionList(vor_offsets, vor_indices)
+        internalRegions = vor_regions[:numSeeds]
         
         # Compute some usefull lists
         nv = len(vor_vertices)
-        externalRegions = [vor_regions[r] for r in range(numSeeds, numSeeds+numBarriers)]
-        externalVertex = set([v for v in sum(externalRegions, []) if v != -1])
+        externalRegions = vor_regions[numSeeds:numSeeds+numBarriers]
+        isExternal = np.zeros(nv, dtype=bool)
+        isExternal[vor_indices[vor_offsets[numSeeds]:]] = True
         # internalVertex = set([v for v in sum(internalRegions,[]) if v not in externalVertex])
         # unusedVertex = set([v for v in range(nv) if v not in externalVertex and v not in internalVertex])
-        unusedVertex = set()
 
         ###########################################################        
         # Check and solve pairs of vertex too near...
-        print("Check and merge pairs of vertex too near...")
-        for i in range(nv):
-            for j in range(i + 1, nv):
-                dist = np.linalg.norm(vor_vertices[i] - vor_vertices[j])
-                isExternalEdge = i in externalVertex and j in externalVertex
-                # TODO: Avoid a hardcoded value here. Maybe 2*pi*cityRadius / len(externalVertex)
-                if dist < (10.0 + 10.0 * isExternalEdge):
-                    print("  Distance from vertex", i, "to vertex", j, "=", dist, "(external edge)" * isExternalEdge)
-                    # Merge voronoi vertex i and j in the midpoint
-                    midpoint = 0.5 * (np.array(vor_vertices[i]) + np.array(vor_vertices[j]))
-                    vor_vertices[i] = midpoint
-                    vor_vertices[j] = midpoint
-                    # print("  * Vertex", i, "and vertex", j, "merged at position:", midpoint)
-                    # Mark vertex j as unused
-                    unusedVertex.add(j)
-                    # Change all references to vertex j to vertex i. Vertex j will remain unused.
-                    for r in vor_regions:
-                        if j in vor_regions[r]:
-                            if i in vor_regions[r]:
-                                # print("  * Remove vertex", j, "in region ", region)
-                                vor_regions[r].remove(j)
-                            else:
-                                # print("  * Usage of vertex", j, "replaced by", i, "in region", region)
-                                for k, v in enumerate(vor_regions[r]):
-                                    if v == j:
-                                        vor_regions[r][k] = i
-
-        # Remove usage of unusedVertex
+        # Near vertex are found with a spatial hash, and joined in clusters (so chains of
+        # near vertex are merged together). The distance is doubled for external vertex.
+        mergeDistance = 0.13 * minSeedDistance
+        print("Check and merge pairs of vertex too near... (mergeDistance=%g)" % mergeDistance)
+        near_i, near_j = nearPairs(vor_vertices, 2 * mergeDistance)
+        dist = np.linalg.norm(vor_vertices[near_i] - vor_vertices[near_j], axis=1)
+        near = dist < mergeDistance * (1 + (isExternal[near_i] & isExternal[near_j]))
+        label = unionFind(nv, near_i[near], near_j[near])
+        unusedVertex = set(np.flatnonzero(label != np.arange(nv)).tolist())
         if unusedVertex:
-            print("  Repacking unusedVertex", unusedVertex)
-            vertexToReuse = [x for x in unusedVertex if x < nv - len(unusedVertex)]
-            if vertexToReuse:
-                vertexToRemove = [x for x in range(nv) if x not in unusedVertex][-len(vertexToReuse):]
-                #print("vertexToReuse=",vertexToReuse)
-                #print("vertexToRemove=",vertexToRemove)
-
-                for i, vi in enumerate(vertexToRemove):
-                    vj = vertexToReuse[i]
-                    #print("Using Vertex", vj, "instead vertex", vi)
-                    vor_vertices[vj] = vor_vertices[vi]
-                    for r in vor_regions:
-                        if vi in vor_regions[r]:
-                            if vj in vor_regions[r]:
-                                # print("  * Remove vertex", vi, "in region ", region)
-                                vor_regions[r].remove(vi)
-                            else:
-                                # print("  * Usage of vertex", vi, "replaced by", vj, "in region", region)
-                                for k, vk in enumerate(vor_regions[r]):
-                                    if vk == vi:
-                                        vor_regions[r][k] = vj
-
-            # Remove last vertex from vertices
-            nv -= len(unusedVertex)
-            vor_vertices = vor_vertices[0:nv]
+            print("  Merge", near.sum(), "pairs of vertex in", len(set(label[list(unusedVertex)].tolist())),
+                  "clusters")
+            # Move the vertex of each cluster to its centroid
+            counts = np.bincount(label, minlength=nv)
+            centroids = np.zeros((nv, 2))
+            np.add.at(centroids, label, vor_vertices)
+
+            # Remove unusedVertex. Change all references using an old -> new lookup array
+            used = label == np.arange(nv)
+            lookup = (np.cumsum(used) - 1)[label]
+            vor_vertices = centroids[used] / counts[used, None]
+            # Remap the regions by chunks (each region is remapped on its own)
+            offsets = work.empty('merge_offsets', len(vor_offsets), vor_offsets.dtype)
+            indices = work.empty('merge_indices', len(vor_indices), vor_indices.dtype)
+            offsets[0] = size = 0
+            for r0, r1 in work.regionChunks(vor_offsets):
+                chunkOffsets, chunkIndices = remapRegions(vor_offsets[r0:r1+1] - vor_offsets[r0],
+                                                          vor_indices[vor_offsets[r0]:vor_offsets[r1]], lookup)
+                offsets[r0+1:r1+1] = size + chunkOffsets[1:]
+                indices[size:size+len(chunkIndices)] = chunkIndices
+                size += len(chunkIndices)
+            vor_offsets, vor_indices = offsets, indices[:size]
+            vor_regions = RegionList(vor_offsets, vor_indices)
+            internalRegions = vor_regions[:numSeeds]
+            nv = len(vor_vertices)
             print("  numVertex after repacking", nv)
-            externalRegions = [vor_regions[r] for r in range(numSeeds, len(vor_regions))]
-            externalVertex = set([v for v in sum(externalRegions, []) if v != -1])
 
         # Plot data after joining near vertex
         if debugSVG:
@@ -493,20 +2004,23 @@ class CityData(dict):
 
         ###########################################################
         # Extract the list of internal and external regions
-        internalRegions = [vor_regions[r] for r in range(numSeeds)]
-        externalRegions = [vor_regions[r] for r in range(numSeeds, len(vor_regions))]
+        internalRegions = vor_regions[:numSeeds]
+        externalRegions = vor_regions[numSeeds:]
 
         print("internalRegions=", len(internalRegions), " externalRegions=", len(externalRegions))
         # print("internalRegionsAreas=",regionAreas)
 
-        # Build the list of edges in internal regions
-        vor_edges = []
-        for r in internalRegions:
-            # add all edges of regions
-            vor_edges += list(zip(r[-1:]+r[:-1], r))
+        # Build the half-edges of internal regions. Edges with no twin are in the boundary
+        regionOffsets, regionIndices = internalRegions.csr()
+        src, dst, region, twin = halfEdges(regionOffsets, regionIndices)
+        externalEdgesDict = dict(zip(src[twin < 0].tolist(), dst[twin < 0].tolist()))
 
-        # Build the list of external edges (as a dict)
-        externalEdgesDict = {a:b for (a,b) in vor_edges if (b, a) not in vor_edges}
+        # Region adjacency: the regions at both sides of each internal edge
+        inner = np.flatnonzero(twin >= 0)
+        pairs = np.unique(np.column_stack((region[inner], region[twin[inner]])), axis=0)
+        first = np.searchsorted(pairs[:, 0], np.arange(numSeeds + 1))
+        neighbours = pairs[:, 1].tolist()
+        regionAdjacency = [neighbours[first[r]:first[r+1]] for r in range(numSeeds)]
 
         # sort the edges in CCW order and extract the external vertex
         v = next(iter(externalEdgesDict))  # get a random key in the dict
@@ -541,7 +2055,11 @@ class CityData(dict):
         meanVertex = vor_vertices[meanPos]
         print("Current centroid", centroid, "Nearest Vertex", meanVertex)
         # Traslate all voronoi vertex so there is always a vertex in (0,0)
-        vertices = vor_vertices - meanVertex
+        vertices = work.empty('vertices', vor_vertices.shape)
+        for a, b in work.chunks(len(vertices)):
+            vertices[a:b] = vor_vertices[a:b] - meanVertex
+        del vor_vertices
+        work.report("merge and boundary")
         barrierSeeds = barrierSeeds - meanVertex
 
         # Plot data after recentering
@@ -549,13 +2067,7 @@ class CityData(dict):
             plotVoronoiData(vertices, internalRegions, barrierSeeds, 'tmp3.2.recenter', cityRadius)
 
         # Compute the signed area to ensure positive orientation of the wall
-        cityArea = 0
-        for i in range(len(externalPoints)):
-            x1 = vertices[externalPoints[i - 1]][0]
-            y1 = vertices[externalPoints[i - 1]][1]
-            x2 = vertices[externalPoints[i]][0]
-            y2 = vertices[externalPoints[i]][1]
-            cityArea += 0.5 * (x1 * y2 - x2 * y1)
+        cityArea = regionMoments(vertices, [0, len(externalPoints)], externalPoints)[0][0]
 
         # Reverse externalPoints if area is negative
         if (cityArea < 0):
@@ -568,38 +2080,7 @@ class CityData(dict):
         # Compute a surrounding polygon (usefull for city walls)
         print("Creating Wall Vertices")
 
-        def computeEnvelope(vertexList, distance=4.0):
-            """ Compute the envelope (surrounding polygon at given distance)
-            vertexList -- list of coordinates (or an array of 2 columns)
-            distance -- Distance to displace the envelope (negative will work)
-            """
-            nv = len(vertexList)
-            #Create a copy of input as numpy.array
-            envelope = np.array(vertexList)
-            # Compute the vector for each side (vertex to its previous)
-            edgeP = [envelope[i]-envelope[i-1] for i in range(nv)]
-            # Normalice the vector for each side
-            edgeP = [x/np.linalg.norm(x) for x in edgeP]
-            #Compute edge vectors (vertex to its next)
-            edgeN= np.array([-edgeP[(i+1)%nv] for i in range(nv)])
-            # Compute the normal to each side
-            edgeNormals = np.array([(x[1], -x[0]) for x in edgeP])
-
-            # Compute internal angles (as cosines and sines)
-            alphaC = np.array([np.dot(edgeP[i],edgeN[i]) for i in range(nv)])
-            alphaS = np.array([np.cross(edgeN[i],edgeP[i]) for i in range(nv)])
-            # compute tangent weights as tan((pi - alpha) / 2) = sin(alpha)/(1-cos(alpha))
-            w = alphaS / (1.0 - alphaC)
-            
-            #Compute the weighted external bisector for each vertex
-            bisector = edgeNormals + np.array([w[i]*edgeP[i] for i in range(nv)])
-
-            # Displace the external vertices by the bisector
-            envelope += distance * bisector
-            
-            return envelope
-
-        wallVertices = computeEnvelope([vertices[i] for i in externalPoints], 4.0)
+        wallVertices = offsetPolygon(vertices[externalPoints], 4.0)
         
         # Plot data with external wall vertices. Tricked to plot a closed line.
         wv = wallVertices.tolist()+[wallVertices[0]]
@@ -751,67 +2232,12 @@ class CityData(dict):
             f.write("\n")
         #"""
 
-        def RMDF_Point(a, b, noiseFactor=0.0):
-            """
-            Compute midpoint of segment [a,b] displaced by a random noise factor
-            """
-            # Compute the midpoint
-            midPoint = 0.5 * np.array(b+a)
-            # Compute the orientation of displacement, perpendicular to segment a->b
-            disp = np.array(b-a)
-            # Rotate d around Z axis
-            if disp.size > 1:
-                tmp = disp[0]
-                disp[0] = -disp[1]
-                disp[1] = tmp
-                
-            # Compute randomly displaced midpoint
-            return midPoint + disp * noiseFactor * (np.random.random_sample() - 0.5)
-
-        def RMDF_Polyline(L, maxDistance, noiseFactor=0.0, circular=False):
-            """
-            Compute Random Midpoint Displacement Fractal for each segment of a polyline.
-
-            Args:
-                L (list): A list of vertex (scalar or vector)
-                maxDistance (float): Max length allowed for each segment in result.
-                noiseFactor (float) : Noise strength used in the displacement. 
-                circular (bool): See L as a closed (circular) polyline.
-
-            Returns:
-                list: The list of vertex for the RMDF subdivision
-            """
-            
-            # Repeat first element to build a closed polyline
-            if circular:
-                #L = L + [L[0]]
-                L = np.append(L, [L[0]], axis=0)
-                    
-            # Repeat subdivision while any segment is longer than maxDistance
-            doAgain=True
-            while doAgain:
-                doAgain=False
-                L2=[]
-                # Iterate over pairs of elements of L
-                for i in range(len(L)-1):
-                    L2.append(L[i])
-                    #distance=np.sqrt((L[i+1]-L[i])*(L[i+1]-L[i]))
-                    #Check if segment L[i]->L[i+1] should be subdivided
-                    distance = np.linalg.norm(L[i+1]-L[i])
-                    if distance > maxDistance:        
-                        L2.append(RMDF_Point(L[i], L[i+1], noiseFactor))
-                        doAgain=True
-                # Append last element of polyline
-                L = L2 + [L[-1]]
-
-            return L
-
         # Add a road to the door
         gatePosition = (wallVertices[0]+wallVertices[-1])/2
         #Build a segment that go out of the city
         roadSkel = [gatePosition, 3*gatePosition]
         #Random Midpoint Displacement Fractal previous roadSkel
-        roadSkel = np.array(RMDF_Polyline(roadSkel, 25, noiseFactor=0.4))
+        roadSkel = rmdfPolyline(roadSkel, 25, noiseFactor=0.4)
         
         """
         if args.get('createTrail', False):
@@ -819,34 +2245,97 @@ class CityData(dict):
             trailWidth = 5
 
             createSandCircle(gateMid.to_3d(), 2*(gate1-gateMid).length)
-            skeleton_list = newRMDFractal(origin, (origin * 3), 0.20, 7, [])
-            meshFromSkeleton(skeleton_list, trailWidth, [], [], [], "_Trail", "Sand")
+            skeleton_list = newRMDFractal(origin, (origin * 3), 0.20, 7)
+            meshFromSkeleton(skeleton_list, trailWidth, "_Trail", "Sand")
         """
 
+        ###########################################################
+        # Compute the "Onion model" lines of each region, so cityGen3D only reads them
+        curbDistance = getattr(args, 'curbDistance', 1.0)
+        houseDistance = getattr(args, 'houseDistance', 2.5)
+
+        # Choose the types used to store coordinates and indices
+        if getattr(args, 'compact', False):
+            floatType = np.float32
+            vertexType = indexType(len(vertices))
+            print("Compact mode: store coordinates as float32 and vertex indices as", np.dtype(vertexType))
+            vor_offsets = work.store('region_offsets', vor_offsets, indexType(len(vor_indices)))
+            vor_indices = work.store('region_indices', vor_indices, vertexType)
+            externalPoints = np.array(externalPoints, dtype=vertexType)
+            internalRegions = RegionList(vor_offsets, vor_indices, 0, numSeeds)
+            vor_regions = RegionList(vor_offsets, vor_indices)
+        else:
+            floatType = np.float64
+
+        # Compute the lines and a table with the metrics of each region (area, centroid, ...) by chunks
+        curbLines = work.empty('curbLines', (len(regionIndices), 2), floatType)
+        houseLines = work.empty('houseLines', (len(regionIndices), 2), floatType)
+        metrics = {}
+        for r0, r1 in work.regionChunks(regionOffsets):
+            offsets = regionOffsets[r0:r1+1] - regionOffsets[r0]
+            indices = regionIndices[regionOffsets[r0]:regionOffsets[r1]]
+            chunk = slice(regionOffsets[r0], regionOffsets[r1])
+            curbLines[chunk] = offsetPolygons(vertices, offsets, indices, -curbDistance)
+            houseLines[chunk] = offsetPolygons(vertices, offsets, indices, -houseDistance)
+            chunkMetrics = regionMetrics(vertices, offsets, indices)
+            # Area between the curb and the house lines (where cityGen3D scatters the leaves)
+            lineIndices = np.arange(len(indices))
+            chunkMetrics['sidewalkArea'] = regionMoments(curbLines[chunk], offsets, lineIndices)[0] - \
+                regionMoments(houseLines[chunk], offsets, lineIndices)[0]
+            for k, v in chunkMetrics.items():
+                if k not in metrics:
+                    dtype = floatType if v.dtype.kind == 'f' else v.dtype
+                    metrics[k] = work.empty('metrics_' + k, (numSeeds,) + v.shape[1:], dtype)
+                metrics[k][r0:r1] = v
+        curbLines = RegionList(regionOffsets, curbLines)
+        houseLines = RegionList(regionOffsets, houseLines)
+        if floatType != vertices.dtype:
+            vertices = work.store('compact_vertices', vertices, floatType)
+        work.report("region lines and metrics")
+
         # Assemble all information as a dict
         data  = {
         'log': "-s %d -r %f --randomSeed %d %s" % (numSeeds, cityRadius, randomSeed, datetime.now()),
-        'seeds': barrierSeeds.tolist(),
-        'vertices': vertices.tolist(),
-        'regions': vor_regions,    
-        'internalRegions': internalRegions,
+        'seeds': barrierSeeds.astype(floatType),
+        'vertices': vertices,
+        'region_offsets': vor_offsets,
+        'region_indices': vor_indices,
+        'numInternalRegions': numSeeds,
+        'regionMetrics': metrics,
+        'regionAdjacency': regionAdjacency,
+        'curbDistance': curbDistance,
+        'houseDistance': houseDistance,
+        'curbLines': curbLines,
+        'houseLines': houseLines,
         'externalPoints': externalPoints,
-        'wallVertices': wallVertices.tolist(),
-        'roadSkel':roadSkel.tolist(),
+        'wallVertices': wallVertices.astype(floatType),
+        'roadSkel': roadSkel.astype(floatType),
         'staticRegions': { k:v[0] for k,v in staticRegions.items() }  ,
         'cityRadius': cityRadius,
+        'relaxation': relaxation,
         }
         self.update(data)
         self.data = data
+        # Keep the CSR regions, and adapters for callers that expect lists of regions
+        self.region_offsets = vor_offsets
+        self.region_indices = vor_indices
+        self['regions'] = vor_regions
+        self['internalRegions'] = internalRegions
 
     def exportJSON(self, filename):
         """Save data to JSON to be read by cityGen3D
+        Arrays (as the CSR regions) are saved as flat lists. In out-of-core mode,
+        the JSON is written without indentation, streaming the big arrays by chunks.
         """
         with open(filename, 'w') as f:
-            json.dump(self.data, f, indent=4, separators=(',', ':'), sort_keys=True)
+            if self.work.path:
+                writeJSON(self.data, f, self.work.chunkSize)
+            else:
+                json.dump(self.data, f, indent=4, separators=(',', ':'), sort_keys=True, default=jsonArray)
         
     def exportSVG(self, filename='', labels=False, radius=None):
         """Plot a 2D representation of cityData dict
+        The file is written while the regions are processed, so it is not kept in memory.
         """
             
         #Coordinates or the origin (center of the image)
@@ -861,23 +2350,6 @@ class CityData(dict):
         svgRegions = '<g id="regions" style="fill:#ffeeaa;stroke:black;stroke-width:1">\n'
         svgLabels = '<g id="labels" style="fill:black;text-anchor:middle">\n'
         palette=["#9c9fff", "#ff89b5", "#ffdc89", "#90d4f7", "#71e096", "#f5a26f", "#ed6d79", "#cff381"]
-        
-        # Plot voronoi regions
-        vertices = self['vertices']
-        for r, region in enumerate(self['internalRegions']):
-            polygon = [(OX+vertices[i][0], OY-vertices[i][1]) for i in region]
-            svgRegions += '  <polygon style="fill:'+palette[r%len(palette)]
-            svgRegions += '" points="' + ' '.join("%g,%g" % v for v in polygon) 
-            svgRegions += '" />\n'
-            if labels:
-                # plot a label for the region in the centroid of the region
-                xy=np.average(polygon, axis=0)
-                svgLabels += '<text x="%g" y="%g">r%d</text>\n' % (xy[0], xy[1], r)
-        
-        # Labels for voronoi vertex 
-        if labels:
-            for i, v in enumerate(self['vertices']):
-                svgLabels += '<text x="%g" y="%g">%d</text>\n' % (OX+v[0], OY-v[1], i)
 
         extraData = []
         if 'wallVertices' in self:
@@ -887,23 +2359,47 @@ class CityData(dict):
         if 'barrierSeeds' in self:
             extraData.append((self['barrierSeeds'], False))
 
-        # Plot extra data
-        for extraV, extraR, color in extraData:
-            #Plot Extra vertex as a polygon
-            if extraR:
-                svgRegions += '  <polyline style="fill:none;stroke:%s;stroke-width:2"' % color
-                svgRegions += ' points="' + ' '.join("%g,%g"%(OX+v[0],OY-v[1]) for v in extraV) 
-                svgRegions += '" />\n'
-                
-            # Plot barrierSeeds/extra data
-            for v in extraV:
-                svgRegions += '<circle cx="%g" cy="%g" r="3" stroke="%s" stroke-width="1" fill="red" />' % (OX+v[0], OY-v[1], color)
-
         if not filename.endswith('.svg'):
             filename += ".svg"
 
         with open(filename, "w") as svg_file:
-            svg_file.write(svgHeader+svgRegions+'\n</g>\n'+svgLabels+'\n</g>\n'+svgFooter)
+            svg_file.write(svgHeader+svgRegions)
+
+            # Plot voronoi regions
+            vertices = np.asarray(self['vertices'])
+            for r, region in enumerate(self['internalRegions']):
+                polygon = [(OX+x, OY-y) for x, y in vertices[region].tolist()]
+                svgRegion = '  <polygon style="fill:'+palette[r%len(palette)]
+                svgRegion += '" points="' + ' '.join("%g,%g" % v for v in polygon)
+                svgRegion += '" />\n'
+                svg_file.write(svgRegion)
+
+            # Plot extra data
+            for extraV, extraR, color in extraData:
+                #Plot Extra vertex as a polygon
+                if extraR:
+                    svgRegion = '  <polyline style="fill:none;stroke:%s;stroke-width:2"' % color
+                    svgRegion += ' points="' + ' '.join("%g,%g"%(OX+v[0],OY-v[1]) for v in extraV)
+                    svgRegion += '" />\n'
+                    svg_file.write(svgRegion)
+
+                # Plot barrierSeeds/extra data
+                for v in extraV:
+                    svg_file.write('<circle cx="%g" cy="%g" r="3" stroke="%s" stroke-width="1" fill="red" />' % (
+                        OX+v[0], OY-v[1], color))
+
+            svg_file.write('\n</g>\n'+svgLabels)
+            if labels:
+                # plot a label for each region in the centroid of the region
+                for r, xy in enumerate(self['regionMetrics']['centroid']):
+                    svg_file.write('<text x="%g" y="%g">r%d</text>\n' % (OX+xy[0], OY-xy[1], r))
+
+                # Labels for voronoi vertex
+                for a, b in self.work.chunks(len(vertices)):
+                    for i, v in enumerate(vertices[a:b].tolist(), a):
+                        svg_file.write('<text x="%g" y="%g">%d</text>\n' % (OX+v[0], OY-v[1], i))
+
+            svg_file.write('\n</g>\n'+svgFooter)
             
 def plotVoronoiData(vertices, regions, extraV, filename, radius, labels=False, extraR=False):
     """Plot a 2D representation of voronoi data as vertices, regions, seeds
@@ -952,67 +2448,92 @@ def plotVoronoiData(vertices, regions, extraV, filename, radius, labels=False, e
     with open(filename, "w") as svg_file:
         svg_file.write(svgHeader+svgRegions+'\n</g>\n'+svgLabels+'\n</g>\n'+svgFooter)
     
-def newAIData(regions, vertices):
+def newAIData(regions, vertices, compact=False, work=None):
     """Compute the matrices used to drive the AI.
+    regions -- List of regions (or a RegionList)
+    compact -- Store distances as float32 and vertex indices as int16/int32
+    work    -- WorkDir where the matrices are stored. In out-of-core mode only the
+               neighbours are computed: the all-pairs matrices need n^2 values and
+               n^3 time, which do not fit the very large maps of that mode
+    The shortest paths are computed with Floyd-Warshall, updating the rows
+    for each intermediate vertex k by chunks.
     see: https://en.wikipedia.org/wiki/Adjacency_matrix    
+    see: https://en.wikipedia.org/wiki/Floyd%E2%80%93Warshall_algorithm
     """
+    work = work or WorkDir()
+    vertices = np.asarray(vertices, dtype=np.float64)
+    n = len(vertices)
+
+    # Get the edges (pairs of consecutive vertex) of all regions, without repetitions
+    if isinstance(regions, RegionList):
+        offsets, indices = regions.csr()
+    else:
+        offsets = np.cumsum([0] + [len(a) for a in regions])
+        indices = np.array([v for a in regions for v in a], dtype=np.int64)
+    prv, _ = polygonNeighbours(offsets, len(indices))
+    edges = np.unique(np.sort(np.column_stack((indices[prv], indices)).astype(np.int64), axis=1), axis=0)
+    edges = edges[edges[:, 0] != edges[:, 1]]
+    x, y = edges[:, 0], edges[:, 1]
+    d = vertices[y] - vertices[x]
+    distance = np.sqrt(d[:, 0] * d[:, 0] + d[:, 1] * d[:, 1])
+
+    # Build the lists of neighbours of each vertex (sparse adjacency matrix)
+    src = np.concatenate((x, y))
+    dst = np.concatenate((y, x))
+    order = np.lexsort((dst, src))
+    first = np.searchsorted(src[order], np.arange(n + 1))
+    dst = dst[order].tolist()
+    neighbours = {v: dst[first[v]:first[v+1]] for v in range(n)}
+    if work.path:
+        print("Out-of-core mode: skip the all-pairs AI matrices (%d x %d). Save only the neighbours" % (n, n))
+        return {'neighbours': neighbours}
+
+    # Initialize directDistanceMatrix and decisionMatrix
+    directDistanceMatrix = work.empty('directDistanceMatrix', (n, n))
+    decisionMatrix = work.empty('decisionMatrix', (n, n), indexType(n) if compact else int)
+    for a, b in work.chunks(n, n):
+        directDistanceMatrix[a:b] = np.inf
+        decisionMatrix[a:b] = 0
+    directDistanceMatrix[np.arange(n), np.arange(n)] = 0
+    decisionMatrix[np.arange(n), np.arange(n)] = np.arange(n)
+    directDistanceMatrix[x, y] = directDistanceMatrix[y, x] = distance
+    decisionMatrix[x, y] = y
+    decisionMatrix[y, x] = x
 
-    def distance2D(p1, p2):
-        """Euclidean distance between 2D points"""
-        dx = p2[0] - p1[0]
-        dy = p2[1] - p1[1]
-        return sqrt(dx * dx + dy * dy)
-
-    rangoM = (len(vertices), len(vertices))
-
-    # Initialize adjacencyMatrix as a sparse matrix
-    neighbours = { v:set() for v in range(len(vertices)) }
-    # Initialize directDistanceMatrix
-    directDistanceMatrix = np.full(rangoM, np.inf)
-    np.fill_diagonal(directDistanceMatrix, 0);
-    # Initialize decisionMatrix
-    decisionMatrix = np.zeros(rangoM, dtype=np.int)
-    
-    # Fill adjacencyMatrix and directDistanceMatrix
-    for a in regions:
-        # print("region: %s" % a)
-        for i in range(len(a)):
-            x = a[i - 1]
-            y = a[i]
-            # print("edge: %d -> %d"%(x,y))
-            if directDistanceMatrix[x][y] == np.inf:  # optimization
-                distance = distance2D(vertices[x], vertices[y])
-                neighbours[x].add(y)
-                neighbours[y].add(x)
-                directDistanceMatrix[x][y] = distance
-                directDistanceMatrix[y][x] = distance
-                decisionMatrix[x][y] = y
-                decisionMatrix[y][x] = x
-
-    # Convert sets to lists
-    neighbours = {int(v):list(neighbours[v]) for v in neighbours}
-    
     # Initialize shortestPathMatrix
-    shortestPathMatrix = directDistanceMatrix.copy()
-
-    # Compute shortestPathMatrix with Floyd-Warshall algorithm
-    for k in range(len(vertices)):
-        decisionMatrix[k][k] = k
-        for j in range(len(vertices)):
-            for i in range(len(vertices)):
-                dist_ikj = shortestPathMatrix[i][k] + shortestPathMatrix[k][j]
-                # check if path i -> k -> j is shorter that current i -> j
-                if dist_ikj < shortestPathMatrix[i][j]:
-                    shortestPathMatrix[i][j] = dist_ikj
-                    # when going from i to j, go through node k
-                    decisionMatrix[i][j] = decisionMatrix[i][k]
-
-    # Assemble all information as a dict of plain python matrices (lists of lists)
-    AIData = {'neighbours': neighbours, 'directDistanceMatrix': directDistanceMatrix.tolist(),
-              'shortestPathMatrix': shortestPathMatrix.tolist(), 'decisionMatrix': decisionMatrix.tolist()}
+    shortestPathMatrix = work.store('shortestPathMatrix', directDistanceMatrix)
+
+    # Compute shortestPathMatrix with Floyd-Warshall algorithm.
+    # Row and column k do not change while k is the intermediate vertex
+    for k in range(n):
+        rowK = np.array(shortestPathMatrix[k])
+        for a, b in work.chunks(n, n):
+            dist = shortestPathMatrix[a:b]
+            decision = decisionMatrix[a:b]
+            # check if path i -> k -> j is shorter that current i -> j
+            dist_ikj = dist[:, k, None] + rowK
+            shorter = dist_ikj < dist
+            dist[shorter] = dist_ikj[shorter]
+            # when going from i to j, go through node k
+            decision[shorter] = np.broadcast_to(decision[:, k, None], decision.shape)[shorter]
+
+    # Assemble all information as a dict of matrices (numpy arrays, see jsonArray to save them)
+    if compact:
+        directDistanceMatrix = work.store('compactDirectDistanceMatrix', directDistanceMatrix, np.float32)
+        shortestPathMatrix = work.store('compactShortestPathMatrix', shortestPathMatrix, np.float32)
+    AIData = {'neighbours': neighbours, 'directDistanceMatrix': directDistanceMatrix,
+              'shortestPathMatrix': shortestPathMatrix, 'decisionMatrix': decisionMatrix}
     return AIData
 
 
+def exportAIJSON(AIData, filename, work=None):
+    """Save the AI matrices to JSON to be read by the game (see newAIData)
+    """
+    with open(filename, 'w') as f:
+        if work is not None and work.path:
+            writeJSON(AIData, f, work.chunkSize)
+        else:
+            json.dump(AIData, f, separators=(',', ':'), sort_keys=True, default=jsonArray)
 
 
 ###########################
@@ -1036,6 +2557,23 @@ def main():
                         help='Replot a previous generated city (default="city.data.json")')
     parser.add_argument('-m', '--models', type=str, required=False, nargs='+', default=['Temple'], 
                         help='Add a list of static models defined in a .json+.blend files')
+    parser.add_argument('--backend', required=False, default='python', choices=['auto'] + sorted(triangulationBackends),
+                        help='Backend used to compute the Delaunay triangulation (default=python)')
+    parser.add_argument('--seeding', required=False, default='random', choices=['random', 'bridson', 'tiles'],
+                        help='Method to place the seeds: rejection, Poisson-disk sampling or precomputed '
+                             'blue noise tiles (default=random)')
+    parser.add_argument('--LloydTolerance', type=float, required=False,
+                        help="Run Lloyd's relaxation until relative energy decrease or seed displacement "
+                             "are below this value (default: run 4 steps)")
+    parser.add_argument('--LloydMaxSteps', type=int, default=100, required=False,
+                        help="Max number of Lloyd's relaxation steps when using --LloydTolerance (default=100)")
+    parser.add_argument('--relax', required=False, default='lloyd', choices=['lloyd', 'lbfgs'],
+                        help="Method to relax the seeds: Lloyd's algorithm or L-BFGS (default=lloyd)")
+    parser.add_argument('--compact', required=False, action='store_true',
+                        help='Store coordinates as float32 and indices as int16/int32 (smaller output for big maps)')
+    parser.add_argument('--outOfCore', metavar='DIR', required=False,
+                        help='Keep the regions and region lines as memory mapped files in folder DIR, and skip the '
+                             'all-pairs AI matrices (triangulation, relaxation and vertex merge still run in memory)')
     parser.add_argument('--debug', required=False, action='store_true',
                         help='Create debug SVG files')
     parser.add_argument('--background', required=False, action='store_true')
@@ -1061,22 +2599,28 @@ def main():
         print("Read data from file:", args.plot)
         with open(args.plot, 'r') as f:
             cityData = json.load(f)
+            if 'region_offsets' in cityData:
+                cityData['internalRegions'] = RegionList(cityData['region_offsets'], cityData['region_indices'],
+                                                         0, cityData['numInternalRegions'])
             if 'cityName' in cityData:
                 print("City name: %s" % cityData['cityName'])
                 args.cityName = cityData['cityName']
 
     # Compute matrixes used for AI path finding
     print("Computing matrixes used for AI path finding")
-    AIData = newAIData(cityData['internalRegions'], cityData['vertices'])
+    work = cityData.work if isinstance(cityData, CityData) else WorkDir(args.outOfCore)
+    AIData = newAIData(cityData['internalRegions'], cityData['vertices'], args.compact, work)
     AIFilename = args.cityName + '.AI.json'
     print("Save AI matrixes to:", AIFilename)
-    with open(AIFilename, 'w') as f:
-        json.dump(AIData, f, separators=(',', ':'), sort_keys=True)
+    exportAIJSON(AIData, AIFilename, work)
 
     # Plot debug info
     cityData.exportSVG(args.cityName + '.map.svg', labels=False, radius= args.cityRadius)
     cityData.exportSVG(args.cityName + '.map.verbose.svg', labels=True, radius= args.cityRadius)
 
+    if peakMemory() is not None:
+        print("Peak memory: %.1f MB" % peakMemory())
+
 
 # Call the main function
 if __name__ == "__main__":
@@ -36,6 +36,11 @@ from mathutils import Vector
 from datetime import datetime
 from random import random, uniform, choice, shuffle
 from functools import reduce
+import numpy as np
+
+# Geometry kernels shared with cityGen2D.py
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)) if '__file__' in globals() else os.getcwd())
+from cityGenGeometry import offsetPolygon, rmdfPolyline, ribbonMesh, RegionList
 
 #Set default values for args. Will be overwritten with values at cg-config.json
 args={
@@ -322,31 +327,9 @@ def computeEnvelope(vertexList, distance=0):
     """ Compute the envelope (surrounding polygon at given distance)
     vertexList -- list of coordinates
     distance -- Distance to displace the envelope (negative will reduce the polygon)
+    See cityGenGeometry.offsetPolygon
     """
-    nv = len(vertexList)
-
-    # Compute the unit 2D vector for each side (vertex to its previous)
-    edgeP = [(vertexList[i]-vertexList[i-1]).xy.normalized() for i in range(nv)]
-    #Compute edge vectors (vertex to its next)
-    edgeN=[-edgeP[(i+1)%nv] for i in range(nv)]
-    # Compute the normal to each side rotating each edgeP
-    edgeNormals = [Vector((v[1], -v[0])) for v in edgeP]
-
-    # compute tangent weights as tan((pi - alpha) / 2) = sin(alpha)/(1-cos(alpha))
-    w = [edgeN[i].cross(edgeP[i])/(1.0 - edgeP[i].dot(edgeN[i])) for i in range(nv)]
-    
-    #Compute the weighted external bisector for each vertex
-    bisector = [edgeNormals[i] + w[i]*edgeP[i] for i in range(nv)]
-
-    # Displace the external vertices by the bisector
-    envelope = [vertexList[i].xy + distance * bisector[i] for i in range(nv)]
-    
-    # Check if input is 2D or 3D
-    if len(vertexList[0]) == 2:
-       return envelope
-    else:
-       #Extend to 3D using original Z coordinates
-       return [Vector((envelope[i].x, envelope[i].y, vertexList[i].z)) for i in range(nv)]
+    return [Vector(v) for v in offsetPolygon([v[:] for v in vertexList], distance).tolist()]
 
             
 def bilinear_interpolation(u, v, points):
@@ -360,7 +343,8 @@ def bilinear_interpolation(u, v, points):
     _v = 1 - v
     return _u * _v * points[0] + _u * v * points[1] + u * _v * points[2] + u * v * points[3] 
            
-def createLeaves2(corners, min=0.0, max=1.0, density=0.1, height=0.02, objNames=["DryLeaf"], changeScale=0):
+def createLeaves2(corners, min=0.0, max=1.0, density=0.1, height=0.02, objNames=["DryLeaf"], changeScale=0,
+                  minLine=None, maxLine=None, area=None):
     """Scatter objects in random locations inside a region 
     corners     -- A list of 3D points with the vertex of the region (corners of the city district)
     min         -- minimum distance from region boundary (usually, the used as curbLine)
@@ -368,27 +352,36 @@ def createLeaves2(corners, min=0.0, max=1.0, density=0.1, height=0.02, objNames=
     density     -- Number of object to scatter per unit area
     objNames    -- Names of the objects to scatter
     changeScale -- Randomize the scale of the objects in interval [1-changeScale .. 1+changeScale]
+    minLine, maxLine -- Optional lines at distance min and max, if already computed
+    area        -- Optional area between the lines min and max, if already computed (see sidewalkArea
+                   in the regionMetrics of cityGen2D)
     """    
     if not isinstance(objNames, list):
         objNames = [objNames]
 
     #Compute the "Onion model" coordinates for min and max lines
     zDispl = Vector((0,0,height))
-    minLine = [v + zDispl for v in computeEnvelope(corners, -min)]
-    maxLine = [v + zDispl for v in computeEnvelope(corners, -max)]
+    minLine = [v + zDispl for v in (minLine or computeEnvelope(corners, -min))]
+    maxLine = [v + zDispl for v in (maxLine or computeEnvelope(corners, -max))]
 
     scene=bpy.context.scene            
     obs = []
+
+    # The objects are shared by the trapezoidal subregions of each side, as the area of the
+    # trapezoid (a+b) * h / 2. Only the total area of the region is precomputed by cityGen2D,
+    # so the lengths of the sides are still needed to share them
+    sides = [(minLine[i-1]-minLine[i]).length + (maxLine[i-1]-maxLine[i]).length for i in range(len(corners))]
+    if area is None:
+        area = sum(sides) * (max-min) / 2
     
     #for each side of the region    
     for i in range(len(corners)):
         # Get the four corners for this trapezoidal subregion
         pnts = [minLine[i-1], minLine[i], maxLine[i-1], maxLine[i]]
-        # Compute the area of the trapezoid as (a+b) * h / 2
-        area = ((pnts[0]-pnts[1]).length + (pnts[2]-pnts[3]).length) * (max-min) / 2
         # Compute the number of objects to scatter
-        #print("subregion=", i, "area=", area, "num_objs=", round(density * area) )
-        for _ in range(round(density * area)):
+        numObjects = round(density * area * sides[i] / sum(sides)) if sum(sides) > 0 else 0
+        #print("subregion=", i, "num_objs=", numObjects)
+        for _ in range(numObjects):
             #o = duplicateObject(bpy.data.objects[choice(objNames)], "_leaf")
             o = bpy.data.objects[choice(objNames)].copy()
             o.name = "_leaf"
@@ -406,18 +399,22 @@ def createLeaves2(corners, min=0.0, max=1.0, density=0.1, height=0.02, objNames=
     if obs:
         joinObjectsList(obs)
             
-def makeDistrict(corners, curbReduct=1, houseReduct=1.5, regionID=None, hideWalls=True):
+def makeDistrict(corners, curbReduct=1, houseReduct=1.5, regionID=None, hideWalls=True, curbLine=None,
+                 houseLine=None, centroid=None):
     """Create a polygon/prism to represent a city block
     corners     -- List of 3D points with the vertex of the polygon (corners of the city block)
     curbReduct  -- Distance from streetLine to curbs
     houseReduct -- Distance from curbs to houses
     regionID    -- The ID of this region. Set to None for emptyRegions/specialBuildings
     hideWalls   -- Assign invisible material to collisionWalls
+    curbLine, houseLine -- Optional lines for curbs and houses, if already computed (see cityGen2D)
+    centroid    -- Optional centroid of the region, if already computed (see regionMetrics in cityGen2D)
     """
     nv = len(corners)
 
     #Compute the "Onion model" coordinates for curbs
-    curbLine = computeEnvelope(corners, -curbReduct)
+    if curbLine is None:
+        curbLine = computeEnvelope(corners, -curbReduct)
 
     # 1. Create a mesh for streets around this region
     # This is the space between polygons clist and curbLine
@@ -490,7 +487,8 @@ def makeDistrict(corners, curbReduct=1, houseReduct=1.5, regionID=None, hideWall
         return
 
     #Compute the "Onion model" coordinates for houses
-    houseLine = computeEnvelope(corners, -houseReduct)    
+    if houseLine is None:
+        houseLine = computeEnvelope(corners, -houseReduct)
         
     # 5. Fill boundary of region houseLine with houses (Old method)
     for i in range(nv):
@@ -515,7 +513,8 @@ def makeDistrict(corners, curbReduct=1, houseReduct=1.5, regionID=None, hideWall
 
     # 7. Debug: Create a visible text label with the regionID
     if args.get('debugVisibleTokens', False):    
-        centroid = sum(corners, Vector((0,0,0)))/nv
+        if centroid is None:
+            centroid = sum(corners, Vector((0,0,0)))/nv
         textCurve = bpy.data.curves.new(type="FONT",name="_textCurve")
         textOb = bpy.data.objects.new("_textOb",textCurve)
         textOb.location = (centroid[0], centroid[1], 0.3)
@@ -643,66 +642,28 @@ def nearestSegment(vector , vertices, vert_coords):
     else:
         return (segment2, dist2)
 
-def newRMDFractalPoint(p1, p2, factor, list, res):
-    """ New recursive level of the RMD Fractal algorithm
-            origin    -- The origin of the curve
-            end    -- The end of the curve
-            factor    -- the percentage of lateral dispersion for the curve
-            resolution    -- number of recursive levels (the exponent in base 2 for number of edges of the curve)
-            skeleton    -- the list of points (must be empty)
-            """
-    if (res > 0):
-        pm = (p1 + p2) * 0.5
-        ds = Vector(((p1.y - pm.y), -(p1.x - pm.x), 0.0)) * uniform(-factor, factor)
-        p3 = pm + ds
-
-        newRMDFractalPoint(p1, p3, factor, list, res - 1)
-        list.append(p3) # Adding the new point here, the list will be ordered
-        newRMDFractalPoint(p3, p2, factor, list, res - 1)
-
-
-
 def newRMDFractal(origin, end, factor, resolution):
     """ Create a polyline using the Random Midpoint Displacement Fractal algorithm
         origin    -- The origin of the curve
         end    -- The end of the curve
         factor    -- the percentage of lateral dispersion for the curve
         resolution    -- number of recursive levels (the exponent in base 2 for number of edges of the curve)
+        See rmdfPolyline in cityGenGeometry
         """
-    skeleton = []
-    newRMDFractalPoint(origin, end, factor, skeleton, resolution)
-    return [origin] + skeleton + [end]
-
-
-def meshFromSkeleton(skeleton, width, river_side_a, river_side_b, faces_data, name = "mesh", material = None):
-    skeleton = [skeleton[0]]+skeleton
-    for index in range(0, len(skeleton) - 1):
-        p0 = skeleton[index]
-        p1 = skeleton[index-1]
-        p2 = skeleton[index + 1]
-
-        # The param 'width' controls the width of the river, after the normalizing of it.
-        # This code line is equivalent to '(p1 - p2) * cross(V(0,0,1))'
-        ds = Vector(((p1.y - p2.y), -(p1.x - p2.x), 0.0)).normalized() * width
-        p3 = p0 + ds
-        p4 = p0 - ds
+    skeleton = rmdfPolyline([origin, end], noiseFactor=factor, levels=resolution)
+    return [Vector(p) for p in skeleton]
 
-        # Here, we are creating the two river sides point lists.
-        river_side_a.append(p3)
-        river_side_b.append(p4)
-
-    # Creating an ordered list of the two river sides point lists
-    ordered_points = river_side_a + river_side_b[::-1]
-    last_index = len(ordered_points) - 1
-
-    # Creating the triangle faces list to pass it to the from_pydata function to generate the river mesh.
-    for i in range(len(river_side_a) - 1):
-        faces_data.append((i, last_index - (i + 1), i + 1))
-        faces_data.append((i, last_index - (i + 1), last_index - i))
 
+def meshFromSkeleton(skeleton, width, name = "mesh", material = None):
+    """ Create a ribbon mesh (river, trail...) along a polyline
+        skeleton  -- List of points of the polyline
+        width     -- Distance from the skeleton to each side of the ribbon
+        See ribbonMesh in cityGenGeometry
+        """
+    vertices, faces = ribbonMesh(skeleton, width)
     mesh = bpy.data.meshes.new(name)
     o = bpy.data.objects.new(name, mesh)
-    mesh.from_pydata(ordered_points, [], faces_data)
+    mesh.from_pydata(vertices.tolist(), [], faces.tolist())
     mesh.update(calc_edges=True)
     if material:
         mesh.materials.append(bpy.data.materials[material])
@@ -822,13 +783,18 @@ def main():
             print("City name:", data['name'])
         seeds = data['seeds']
         vertices = [Vector(v) for v in data['vertices'] ]
-        internalRegions = data['internalRegions']
+        if 'region_offsets' in data:
+            # Regions are saved as a CSR pair: region r is region_indices[region_offsets[r]:region_offsets[r+1]]
+            regions = RegionList(data['region_offsets'], data['region_indices'])
+            internalRegions = regions[:data['numInternalRegions']]
+        else:
+            internalRegions = data['internalRegions']
+            # This is a hack to convert dictionaries with string keys to integer.
+            # Necessary because json.dump() store integer keys as strings
+            regions = { int(k):v for k,v in data['regions'].items() }
         externalPoints = data['externalPoints']
         cityRadius = data['cityRadius']
-        # This is a hack to convert dictionaries with string keys to integer.
-        # Necessary because json.dump() store integer keys as strings
-        regions = { int(k):v for k,v in data['regions'].items() }
-        # Same hack to convert dictionaries keys to integer.
+        # Hack to convert dictionaries with string keys to integer.
         staticRegions = { int(k):v for k,v in data['staticRegions'].items() } 
         internalSeeds = [Vector(s) for s in seeds[:len(internalRegions)]]
 
@@ -973,20 +939,35 @@ def main():
         makeGround([], '_groundO', '_groundM', radius=groundRadius, material='Floor3')
         print("\nDone makeGround", (datetime.now()-initTime).total_seconds() )
 
+    # Read the "Onion model" lines of each region, if precomputed by cityGen2D
+    curbDistance = data.get('curbDistance', 1.0)
+    houseDistance = data.get('houseDistance', 2.5)
+    curbLines = [[Vector(v).to_3d() for v in line] for line in data['curbLines']] if 'curbLines' in data else None
+    houseLines = [[Vector(v).to_3d() for v in line] for line in data['houseLines']] if 'houseLines' in data else None
+    # Read the table of metrics (area, centroid,...) of each region, if precomputed by cityGen2D
+    centroids = data['regionMetrics']['centroid'] if 'regionMetrics' in data else None
+    sidewalkAreas = data['regionMetrics'].get('sidewalkArea') if 'regionMetrics' in data else None
+
     # Create paths and polygon for internal regions
     print("Processing", len(internalRegions), "internalRegions")
     for nr, region in enumerate(internalRegions):
         print(nr, end=" ", flush=True)
         corners = [vertices3D[i] for i in region]
+        curbLine = curbLines[nr] if curbLines else None
+        houseLine = houseLines[nr] if houseLines else None
+        centroid = centroids[nr] if centroids else None
+        sidewalkArea = sidewalkAreas[nr] if sidewalkAreas else None
         if args.get('createStreets', False):
             if nr in staticRegions:
                 #Avoid creation of collisionWall, houses and regionLabels 
-                makeDistrict(corners, 1.0, 2.5, regionID=None)
+                makeDistrict(corners, curbDistance, houseDistance, regionID=None, curbLine=curbLine)
             else:            
-                makeDistrict(corners, 1.0, 2.5, regionID=nr)
+                makeDistrict(corners, curbDistance, houseDistance, regionID=nr, curbLine=curbLine,
+                             houseLine=houseLine, centroid=centroid)
                 
         if args.get('createLeaves', False):
-            createLeaves2(corners, 1.0, 2.5, density=0.4, height=0.02, objNames=["DryLeaf"], changeScale=0.4)
+            createLeaves2(corners, curbDistance, houseDistance, density=0.4, height=0.02, objNames=["DryLeaf"],
+                          changeScale=0.4, minLine=curbLine, maxLine=houseLine, area=sidewalkArea)
             # Another posible usage is to scatter obstacles all the way like
             #createLeaves2(corners, 0.0, 2.0, density=0.2, height=0.02, objNames=["DryLeaf", "Valla"], changeScale=0.3)
             
@@ -1009,13 +990,13 @@ def main():
         distance = cityRadius * 2
         skeleton_list = newRMDFractal(Vector((-distance, distance * 2, 0.1)),
                                       Vector((-distance, -distance * 2, 0.1)),
-                                      0.25, 7, [])
-        meshFromSkeleton(skeleton_list, 20, [], [], [], "_River", "Water")
+                                      0.25, 7)
+        meshFromSkeleton(skeleton_list, 20, "_River", "Water")
 
     if args.get('createTrail', False):
         trailWidth = 3
         roadSkel3D = [Vector(x).to_3d() for x in data['roadSkel']]        
-        meshFromSkeleton(roadSkel3D, trailWidth, [], [], [], "_Trail", "Sand")
+        meshFromSkeleton(roadSkel3D, trailWidth, "_Trail", "Sand")
         createSandCircle(gateMid.to_3d(), (gate1-gateMid).length)
 
     #Save the current file, if outputCityFilename is set.
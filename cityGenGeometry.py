@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Geometry kernels from project citygen, shared by cityGen2D.py and cityGen3D.py
+Only needs numpy (also bundled with blender), so it can be imported from both
+scripts. Polygons are arrays (n x 2) or (n x 3) of coordinates. A set of
+polygons is given as a CSR pair: polygon i is indices[offsets[i]:offsets[i+1]]
+"""
+
+import numpy as np
+
+
+def polygonNeighbours(offsets, n):
+    """Compute the index of the previous and the next vertex of each vertex
+    in a set of polygons, given as the offsets of a CSR pair.
+    """
+    offsets = np.asarray(offsets)
+    prv = np.arange(-1, n - 1)
+    nxt = np.arange(1, n + 1)
+    prv[offsets[:-1]] = offsets[1:] - 1
+    nxt[offsets[1:] - 1] = offsets[:-1]
+    return prv, nxt
+
+
+def regionMoments(vertices, offsets, indices):
+    """Compute the area, the centroid and the polar moment of inertia (about
+    the origin) of a set of polygons, given as a CSR pair: polygon i is
+    vertices[indices[offsets[i]:offsets[i+1]]].
+    Uses the shoelace formula, summed for all polygons at once. Polygons
+    must have three vertex at least. The area is negative for CW polygons.
+    ref: https://en.wikipedia.org/wiki/Centroid#Of_a_polygon
+    ref: https://en.wikipedia.org/wiki/Second_moment_of_area#Any_polygon
+    """
+    offsets = np.asarray(offsets)
+    p = np.asarray(vertices, dtype=np.float64)[indices, :2]
+    prv, nxt = polygonNeighbours(offsets, len(p))
+    q = p[nxt]
+    cross = p[:, 0] * q[:, 1] - q[:, 0] * p[:, 1]
+    area = 0.5 * np.add.reduceat(cross, offsets[:-1])
+    centroid = np.add.reduceat((p + q) * cross[:, None], offsets[:-1]) / (6 * area[:, None])
+    inertia = np.add.reduceat(cross * (p * p + p * q + q * q).sum(axis=1), offsets[:-1]) / 12
+    return area, centroid, inertia
+
+
+def regionMetrics(vertices, offsets, indices):
+    """Compute a table with the metrics of a set of polygons, given as a CSR
+    pair, so later stages can read them instead of computing them again.
+    Returns a dict with an entry (array) for each metric, with a value for each polygon:
+      area      -- Area (negative for CW polygons)
+      centroid  -- True centroid [x, y] (not the average of the vertex)
+      perimeter -- Sum of the length of the sides
+      bbox      -- Bounding box [xmin, ymin, xmax, ymax]
+      numEdges  -- Number of sides
+      minEdge, maxEdge -- Length of the shortest and the longest side
+    """
+    offsets = np.asarray(offsets)
+    p = np.asarray(vertices, dtype=np.float64)[indices, :2]
+    _, nxt = polygonNeighbours(offsets, len(p))
+    first = offsets[:-1]
+    area, centroid, inertia = regionMoments(p, offsets, np.arange(len(p)))
+    edges = np.linalg.norm(p[nxt] - p, axis=1)
+    bbox = np.column_stack((np.minimum.reduceat(p, first), np.maximum.reduceat(p, first)))
+    return {
+        'area': area,
+        'centroid': centroid,
+        'perimeter': np.add.reduceat(edges, first),
+        'bbox': bbox,
+        'numEdges': np.diff(offsets),
+        'minEdge': np.minimum.reduceat(edges, first),
+        'maxEdge': np.maximum.reduceat(edges, first),
+    }
+
+
+class RegionList:
+    """Read only list of regions stored as a CSR pair: region r is the list
+    indices[offsets[r]:offsets[r+1]]. It is a thin adapter for code that
+    expects a list of lists (or a dict with integer keys) of vertex indices.
+    Slices are views of the same CSR pair. Indices may be rows of an array
+    too (as the coordinates of a line for each region).
+    """
+
+    def __init__(self, offsets, indices, start=0, stop=None):
+        self.offsets = np.asarray(offsets)
+        self.indices = np.asarray(indices)
+        self.start, self.stop, _ = slice(start, stop).indices(len(self.offsets) - 1)
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, r):
+        if isinstance(r, slice):
+            start, stop, step = r.indices(len(self))
+            if step != 1:
+                raise ValueError("RegionList slices must be contiguous")
+            return RegionList(self.offsets, self.indices, self.start + start, self.start + max(start, stop))
+        if r < 0:
+            r += len(self)
+        if not 0 <= r < len(self):
+            raise IndexError("region index out of range")
+        r += self.start
+        return self.indices[self.offsets[r]:self.offsets[r+1]].tolist()
+
+    def __iter__(self):
+        # Convert each region when it is reached, so the whole list is never built
+        for r in range(len(self)):
+            yield self[r]
+
+    def csr(self):
+        """Return the CSR pair (offsets, indices) of these regions only
+        """
+        offsets = self.offsets[self.start:self.stop + 1]
+        return offsets - offsets[0], self.indices[offsets[0]:offsets[-1]]
+
+    def tolist(self):
+        """Return the regions as a list of lists
+        """
+        offsets, indices = self.csr()
+        indices = indices.tolist()
+        return [indices[offsets[r]:offsets[r+1]] for r in range(len(self))]
+
+
+def offsetPolygons(vertices, offsets, indices, distance, miterLimit=4.0):
+    """ Compute the envelope (surrounding polygon at given distance) of a set
+    of CCW polygons at once. Each vertex is displaced along the weighted
+    external bisector of its corner, so the sides keep parallel to the input.
+    vertices   -- Array (n x 2) or (n x 3) with the coordinates of the vertex
+    offsets, indices -- CSR pair with the vertex of each polygon
+    distance   -- Distance to displace the envelope (negative will reduce the polygon).
+                  May be an array, with a value for each index
+    miterLimit -- Max displacement of a corner, relative to distance. Sharp corners
+                  are cut to this length. Use None for no limit
+    Returns an array with a row for each index. Z coordinates are kept.
+    ref: https://www.w3.org/TR/SVG/painting.html#StrokeMiterlimitProperty
+    """
+    points = np.asarray(vertices, dtype=np.float64)[indices]
+    prv, nxt = polygonNeighbours(offsets, len(points))
+    # Compute the unit 2D vector for each side (vertex to its previous)
+    edgeP = points[:, :2] - points[prv, :2]
+    edgeP /= np.maximum(np.linalg.norm(edgeP, axis=1), 1e-12)[:, None]
+    # Compute edge vectors (vertex to its next)
+    edgeN = -edgeP[nxt]
+    # Compute the normal to each side rotating each edgeP
+    edgeNormals = np.column_stack((edgeP[:, 1], -edgeP[:, 0]))
+
+    # Compute tangent weights as tan((pi - alpha) / 2) = sin(alpha)/(1-cos(alpha))
+    alphaC = (edgeP * edgeN).sum(axis=1)
+    alphaS = edgeN[:, 0] * edgeP[:, 1] - edgeN[:, 1] * edgeP[:, 0]
+    w = alphaS / np.maximum(1.0 - alphaC, 1e-12)
+
+    # Compute the weighted external bisector for each vertex, and cut it to miterLimit
+    bisector = edgeNormals + w[:, None] * edgeP
+    if miterLimit is not None:
+        bisector *= np.minimum(1.0, miterLimit / np.sqrt(1.0 + w * w))[:, None]
+
+    # Displace the vertices by the bisector
+    envelope = points.copy()
+    envelope[:, :2] += np.reshape(distance, (-1, 1)) * bisector
+    return envelope
+
+
+def offsetPolygon(vertexList, distance=0, miterLimit=4.0):
+    """ Compute the envelope (surrounding polygon at given distance) of a CCW polygon
+    vertexList -- list of coordinates (or an array of 2 or 3 columns)
+    distance   -- Distance to displace the envelope (negative will reduce the polygon)
+    See offsetPolygons.
+    """
+    n = len(vertexList)
+    return offsetPolygons(vertexList, [0, n], np.arange(n), distance, miterLimit)
+
+
+def rmdfPolyline(points, maxDistance=0.0, noiseFactor=0.0, circular=False, levels=None):
+    """Compute Random Midpoint Displacement Fractal for each segment of a polyline.
+    Each pass splits at once all the segments longer than maxDistance, moving
+    its midpoint along the normal to the segment by a random fraction of its length.
+    points      -- Array (n x 2) or (n x 3) with the vertex of the polyline
+    maxDistance -- Max length allowed for each segment in result
+    noiseFactor -- Noise strength used in the displacement (max displacement is
+                   noiseFactor/2 times the length of the segment)
+    circular    -- See points as a closed (circular) polyline. Result repeats first vertex
+    levels      -- Max number of passes (with maxDistance=0, every segment is split
+                   in 2**levels segments)
+    Returns an array with the vertex of the subdivided polyline.
+    Uses np.random, as the rest of cityGen2D.
+    ref: https://en.wikipedia.org/wiki/Diamond-square_algorithm
+    """
+    points = np.array(points, dtype=np.float64)
+    if points.ndim == 1:
+        points = points[:, None]
+    if circular:
+        points = np.concatenate((points, points[:1]))
+
+    level = 0
+    while levels is None or level < levels:
+        level += 1
+        disp = points[1:] - points[:-1]
+        split = np.flatnonzero(np.linalg.norm(disp, axis=1) > maxDistance)
+        if len(split) == 0:
+            break
+        # Compute the orientation of displacement, perpendicular to each segment (rotate around Z axis)
+        disp = disp[split]
+        if disp.shape[1] > 1:
+            disp[:, :2] = np.column_stack((-disp[:, 1], disp[:, 0]))
+            disp[:, 2:] = 0
+        # Compute randomly displaced midpoints, and insert them after the first vertex of the segment
+        midPoints = 0.5 * (points[split] + points[split + 1])
+        midPoints += disp * noiseFactor * (np.random.random_sample(len(split)) - 0.5)[:, None]
+        points = np.insert(points, split + 1, midPoints, axis=0)
+    return points
+
+
+def ribbonMesh(skeleton, width):
+    """Compute a ribbon of triangles (for rivers, roads, trails...) along a polyline
+    skeleton -- Array (n x 2) or (n x 3) with the vertex of the polyline
+    width    -- Distance from the skeleton to each side of the ribbon
+    Returns the vertex (2n x 3) of the ribbon, first side forward and second
+    side backwards, and the faces (2(n-1) x 3), as used by mesh.from_pydata.
+    """
+    skeleton = np.asarray(skeleton, dtype=np.float64)
+    n = len(skeleton)
+    points = np.zeros((n, 3))
+    points[:, :skeleton.shape[1]] = skeleton
+    # Displace each vertex along the normal to the segment from its previous to its next vertex
+    tangent = points[np.minimum(np.arange(1, n + 1), n - 1), :2] - points[np.maximum(np.arange(-1, n - 1), 0), :2]
+    ds = np.zeros((n, 3))
+    ds[:, :2] = np.column_stack((-tangent[:, 1], tangent[:, 0]))
+    ds *= width / np.maximum(np.linalg.norm(ds, axis=1), 1e-12)[:, None]
+    vertices = np.concatenate((points + ds, (points - ds)[::-1]))
+
+    # Two triangles for each segment, joining both sides
+    i = np.arange(n - 1)
+    last = 2 * n - 1
+    faces = np.empty((2 * (n - 1), 3), dtype=np.int64)
+    faces[0::2] = np.column_stack((i, last - (i + 1), i + 1))
+    faces[1::2] = np.column_stack((i, last - (i + 1), last - i))
+    return vertices, faces
+
+
+def rmdfRibbon(points, width, maxDistance=0.0, noiseFactor=0.0, circular=False, levels=None):
+    """Build a RMDF polyline and the ribbon mesh along it at once
+    See rmdfPolyline and ribbonMesh.
+    Returns skeleton, vertices, faces
+    """
+    skeleton = rmdfPolyline(points, maxDistance, noiseFactor, circular, levels)
+    vertices, faces = ribbonMesh(skeleton, width)
+    return skeleton, vertices, faces
@@ -179,6 +179,11 @@ def init():
             globalDict['cg-data.json'] = 'From file '+graphFilename
     if 'cityName' in globalDict:
         print("City name: %s" % globalDict['cityName'])
+    # Build the list of regions, if they are stored as a CSR pair (flat arrays of offsets and indices)
+    if 'region_offsets' in globalDict:
+        offsets = globalDict['region_offsets']
+        indices = globalDict['region_indices']
+        globalDict['regions'] = [indices[offsets[r]:offsets[r+1]] for r in range(len(offsets) - 1)]
 
     # Try to read from cg-ia.json controller
     if 'cg-ia.json' in Player.controllers:
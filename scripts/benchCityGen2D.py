@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the 2D stage of project citygen (does not use blender stuff)
+
+Run from the root folder of the project:
+python3 scripts/benchCityGen2D.py circumcenter -n 10000
+python3 scripts/benchCityGen2D.py backends -n 30
+python3 scripts/benchCityGen2D.py check -n 300 --repeat 3
+python3 scripts/benchCityGen2D.py scaling --sizes 1000 10000 100000
+python3 scripts/benchCityGen2D.py parallel -n 200000 --workers 4 8 16
+python3 scripts/benchCityGen2D.py seeding --sizes 100 1000 10000
+python3 scripts/benchCityGen2D.py relax -n 300 --repeat 3
+python3 scripts/benchCityGen2D.py rmdf --sizes 1000 10000 100000
+python3 scripts/benchCityGen2D.py compact -n 2000 --seeding bridson
+python3 scripts/benchCityGen2D.py memory --sizes 250 500 1000 --seeding bridson
+"""
+
+import os, sys, io, json, time, argparse, contextlib, tempfile
+from math import sqrt
+import numpy as np
+
+# Allow to import cityGen2D from the parent folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from cityGen2D import Delaunay2D, DivideConquerDelaunay2D, ParallelDelaunay2D, CityData, circumcircles, \
+    triangulationBackends, newTriangulation, poissonDiskDistance, poissonDiskSeeds, tiledSeeds, blueNoiseTiles, \
+    jsonArray, peakMemory, newAIData, exportAIJSON
+from cityGenGeometry import rmdfRibbon
+from concurrent.futures import ProcessPoolExecutor
+
+
+def timeit(function, *args, repeat=3):
+    """Return the best wall time of several runs of function(*args)
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def newCityData(numSeeds, randomSeed, quiet=True, **kwargs):
+    """Build a CityData with default arguments (as set by cityGen2D.py)
+    """
+    cityArgs = argparse.Namespace(numSeeds=numSeeds, cityRadius=150, gateLen=13.08, randomSeed=randomSeed,
+                                  models=['Temple'], debug=False, backend='python')
+    for k, v in kwargs.items():
+        setattr(cityArgs, k, v)
+    with contextlib.redirect_stdout(io.StringIO() if quiet else sys.stdout):
+        return CityData(cityArgs)
+
+
+def canonicalRegions(cityData):
+    """Describe the regions of a CityData by the coordinates of its corners,
+    so it can be compared with other CityData with different vertex indices.
+    """
+    vertices = np.asarray(cityData['vertices'])
+    regions = cityData['internalRegions']
+    # Remove the translation applied when recentering the city
+    used = sorted(set(v for r in regions for v in r))
+    vertices = vertices - vertices[used].mean(axis=0)
+    result = []
+    for r in regions:
+        corners = [tuple(x) for x in np.round(vertices[r], 3).tolist()]
+        first = corners.index(min(corners))
+        result.append(corners[first:] + corners[:first])
+    return result
+
+
+def benchBackends(args):
+    """Check that every triangulation backend builds the same regions for
+    a set of random seeds, and compare their running time.
+    """
+    backends = sorted(triangulationBackends)
+    failures = 0
+    for randomSeed in range(args.randomSeed, args.randomSeed + args.repeat):
+        results = {}
+        times = {}
+        for backend in backends:
+            try:
+                t0 = time.perf_counter()
+                results[backend] = canonicalRegions(newCityData(args.num, randomSeed, backend=backend,
+                                                                        seeding=args.seeding))
+                times[backend] = time.perf_counter() - t0
+            except ImportError as e:
+                print("  Skip backend", backend, ":", e)
+        same = all(r == results[backends[0]] for r in results.values())
+        failures += not same
+        print("randomSeed %d: %s " % (randomSeed, "same regions" if same else "DIFFERENT REGIONS"),
+              " ".join("%s=%.3fs" % (b, t) for b, t in times.items()))
+    if failures:
+        sys.exit("Backends differ in %d of %d cities" % (failures, args.repeat))
+
+
+def voronoiCorners(dt, n):
+    """Describe the Voronoi regions of the first n points of a triangulation by
+    the coordinates of their corners. Corners repeated by cocircular points
+    (degenerate inputs have several valid triangulations) are removed.
+    """
+    vertices, regions = dt.exportVoronoiRegions()
+    vertices = np.asarray(vertices)
+    result = []
+    for r in range(n):
+        corners = [tuple(x) for x in np.round(vertices[regions[r]], 6).tolist()]
+        corners = [c for k, c in enumerate(corners) if c != corners[k - 1]] or corners[:1]
+        first = corners.index(min(corners))
+        result.append(corners[first:] + corners[:first])
+    return result
+
+
+def checkBackends(args):
+    """Check that every triangulation backend gives the same Voronoi regions,
+    for random points and for degenerate inputs (grids and points on a circle,
+    with many cocircular points). Exits with an error if any backend differs.
+    """
+    side = max(2, int(sqrt(args.num)))
+    grid = 10.0 * np.array([(x, y) for x in range(side) for y in range(side)])
+    angle = 0.3
+    rotation = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+    angles = np.linspace(0, 2 * np.pi, args.num, endpoint=False)
+    inputs = [('grid', grid), ('rotated grid', grid @ rotation.T),
+              ('circle', np.vstack(([[0, 0]], 100 * np.column_stack((np.cos(angles), np.sin(angles))))))]
+    rng = np.random.RandomState(args.randomSeed)
+    inputs += [('random %d' % r, 100 * rng.random_sample((args.num, 2))) for r in range(args.repeat)]
+
+    failures = 0
+    for name, points in inputs:
+        results = {}
+        for backend in sorted(triangulationBackends):
+            try:
+                dt = newTriangulation(backend, center=points.mean(axis=0), radius=10 * np.ptp(points))
+                dt.addPoints(points)
+                results[backend] = voronoiCorners(dt, len(points))
+            except ImportError as e:
+                print("  Skip backend", backend, ":", e)
+        different = [b for b in results if results[b] != results['python']]
+        failures += bool(different)
+        print("%-14s %5d points: %s" % (name, len(points), "DIFFERENT REGIONS in " + ", ".join(different)
+                                         if different else "same regions in " + ", ".join(results)))
+    if failures:
+        sys.exit("Backends differ in %d of %d inputs" % (failures, len(inputs)))
+
+
+def benchScaling(args):
+    """Time to build the triangulation and export the Voronoi regions of
+    random points, for each backend and several number of points.
+    """
+    rng = np.random.RandomState(args.randomSeed)
+    print("%8s" % "points" + "".join("%12s" % b for b in sorted(triangulationBackends)))
+    for n in args.sizes:
+        points = 1000 * rng.random_sample((n, 2))
+        times = []
+        for backend in sorted(triangulationBackends):
+            try:
+                t0 = time.perf_counter()
+                dt = newTriangulation(backend, center=(500, 500), radius=5000)
+                dt.addPoints(points)
+                dt.exportVoronoiRegions()
+                times.append("%11.3fs" % (time.perf_counter() - t0))
+            except ImportError:
+                times.append("%12s" % "-")
+        print("%8d" % n + "".join(times), flush=True)
+
+
+def benchParallel(args):
+    """Speedup of the strip-partitioned ParallelDelaunay2D against the
+    single process divide and conquer, for several number of workers.
+    """
+    rng = np.random.RandomState(args.randomSeed)
+    points = 1000 * rng.random_sample((args.num, 2))
+
+    def build(dt):
+        dt.addPoints(points)
+        return dt
+
+    serial = build(DivideConquerDelaunay2D(center=(500, 500), radius=5000))
+    tSerial = timeit(lambda: build(DivideConquerDelaunay2D(center=(500, 500), radius=5000)), repeat=1)
+    print("Points: %d  cores available: %d" % (args.num, os.cpu_count()))
+    print("  single process: %10.3f s" % tSerial)
+    reference = sorted(map(tuple, np.sort(serial.exportTriangles(), axis=1).tolist()))
+    for workers in args.workers:
+        parallel = build(ParallelDelaunay2D(center=(500, 500), radius=5000, workers=workers))
+        same = sorted(map(tuple, np.sort(parallel.exportTriangles(), axis=1).tolist())) == reference
+        tParallel = timeit(lambda: build(ParallelDelaunay2D(center=(500, 500), radius=5000, workers=workers)),
+                           repeat=1)
+        print("  %2d workers:     %10.3f s  (x%.2f)  %s" % (workers, tParallel, tSerial / tParallel,
+                                                          "same triangles" if same else "DIFFERENT TRIANGLES"))
+
+
+def minDistance(points):
+    """Min distance between two points of a set (uses a triangulation)
+    """
+    dt = newTriangulation('auto', center=points.mean(axis=0), radius=10 * np.ptp(points))
+    dt.addPoints(points)
+    tris = np.asarray(dt.exportTriangles())
+    edges = points[tris] - points[np.roll(tris, 1, axis=1)]
+    return np.sqrt((edges ** 2).sum(axis=2).min())
+
+
+def benchSeeding(args):
+    """Time to generate the non-fixed seeds of a city with Poisson-disk
+    sampling and with precomputed blue noise tiles, at the distance used by
+    CityData (see poissonDiskDistance), and check the min distance between seeds.
+    """
+    cityRadius = 150
+    fixedSeeds = np.array([[0, 0], [10, 0], [0, 10]])
+    samplers = {'bridson': poissonDiskSeeds, 'tiles': tiledSeeds}
+    t0 = time.perf_counter()
+    blueNoiseTiles()
+    print("Load or build blue noise tiles: %.3fs" % (time.perf_counter() - t0))
+    print("%8s %8s %12s %8s %10s" % ("sampler", "seeds", "distance", "found", "time"))
+    for n in args.sizes:
+        seedDistance = poissonDiskDistance(n, cityRadius)
+        for name, sampler in samplers.items():
+            np.random.seed(args.randomSeed)
+            t0 = time.perf_counter()
+            seeds = sampler(n, cityRadius, seedDistance, fixedSeeds)
+            t = time.perf_counter() - t0
+            ratio = minDistance(np.concatenate((seeds, fixedSeeds[:1]))) / seedDistance
+            print("%8s %8d %12.3f %8d %9.4fs  min distance x%.3f" % (name, n, seedDistance, len(seeds), t, ratio),
+                  flush=True)
+
+
+def benchRelax(args):
+    """Number of Voronoi rebuilds needed by Lloyd's relaxation and by the
+    L-BFGS optimizer to reach the energy of Lloyd after several steps.
+    """
+    steps = [5, 20, 50, 100, 200]
+    print("%10s %6s" % ("randomSeed", "relax") + "".join("%10s" % ("lloyd%d" % s) for s in steps))
+    for randomSeed in range(args.randomSeed, args.randomSeed + args.repeat):
+        relaxations = {}
+        for relax in ('lloyd', 'lbfgs'):
+            cityData = newCityData(args.num, randomSeed, seeding='bridson', backend='scipy', relax=relax,
+                                   LloydTolerance=1e-7, LloydMaxSteps=max(steps))
+            relaxations[relax] = cityData['relaxation']
+        targets = [relaxations['lloyd']['energy'][min(s, len(relaxations['lloyd']['energy'])) - 1] for s in steps]
+        for relax, relaxation in relaxations.items():
+            rebuilds = []
+            for target in targets:
+                reached = [r for e, r in zip(relaxation['energy'], relaxation['rebuilds']) if e <= target]
+                rebuilds.append("%10s" % (reached[0] if reached else "-"))
+            print("%10d %6s" % (randomSeed, relax) + "".join(rebuilds), flush=True)
+
+
+def benchRMDF(args):
+    """Time to build a RMDF road (skeleton and ribbon mesh) of several lengths,
+    with segments of length 1 at most.
+    """
+    print("%10s %10s %10s %10s" % ("length", "vertex", "faces", "time"))
+    for n in args.sizes:
+        np.random.seed(args.randomSeed)
+        t0 = time.perf_counter()
+        skeleton, vertices, faces = rmdfRibbon([[0, 0], [n, 0]], 3, maxDistance=1, noiseFactor=0.4)
+        t = time.perf_counter() - t0
+        print("%10d %10d %10d %9.4fs" % (n, len(vertices), len(faces), t), flush=True)
+
+
+def benchCompact(args):
+    """Check that the compact mode (float32 coordinates, int16/int32 indices)
+    builds the same regions as the float64 mode, and compare the size of data.
+    """
+    failures = 0
+    for randomSeed in range(args.randomSeed, args.randomSeed + args.repeat):
+        sizes = {}
+        results = {}
+        for compact in (False, True):
+            cityData = newCityData(args.num, randomSeed, seeding=args.seeding, compact=compact)
+            results[compact] = cityData
+            arrays = [np.asarray(cityData[k]) for k in ('vertices', 'seeds', 'wallVertices', 'region_offsets',
+                                                        'region_indices', 'externalPoints')]
+            sizes[compact] = (sum(a.nbytes for a in arrays),
+                              len(json.dumps(cityData.data, separators=(',', ':'), default=jsonArray)))
+        same = all(np.array_equal(results[False][k], results[True][k])
+                   for k in ('region_offsets', 'region_indices', 'externalPoints'))
+        same = same and results[False]['regionAdjacency'] == results[True]['regionAdjacency']
+        error = np.abs(np.asarray(results[False]['vertices']) - results[True]['vertices']).max()
+        failures += not same
+        print("randomSeed %d: %s  max vertex error %.2g  arrays %d -> %d bytes  json %d -> %d bytes" % (
+            randomSeed, "same topology" if same else "DIFFERENT TOPOLOGY", error,
+            sizes[False][0], sizes[True][0], sizes[False][1], sizes[True][1]), flush=True)
+    if failures:
+        sys.exit("Compact mode differs in %d of %d cities" % (failures, args.repeat))
+
+
+def cityPeakMemory(numSeeds, randomSeed, seeding, outOfCore):
+    """Build and export a CityData and its AI data (the same stages as
+    cityGen2D.py), and return the time and the peak memory of the process.
+    Run it in a new process, so the peak is not shared.
+    """
+    t0 = time.perf_counter()
+    cityData = newCityData(numSeeds, randomSeed, seeding=seeding, backend='scipy', outOfCore=outOfCore)
+    with tempfile.TemporaryDirectory() as folder:
+        cityData.exportJSON(os.path.join(folder, 'city.data.json'))
+        with contextlib.redirect_stdout(io.StringIO()):
+            AIData = newAIData(cityData['internalRegions'], cityData['vertices'], work=cityData.work)
+        exportAIJSON(AIData, os.path.join(folder, 'city.AI.json'), cityData.work)
+        cityData.exportSVG(os.path.join(folder, 'city.map.svg'), radius=150)
+    return time.perf_counter() - t0, peakMemory()
+
+
+def benchMemory(args):
+    """Peak memory (RSS) to build and export cities (and their AI data) of
+    several sizes, keeping the arrays in memory and in out-of-core mode (memory
+    mapped files). In memory, the all-pairs AI matrices set the peak (n^2), so
+    keep the sizes small. Out-of-core mode skips them, and its peak is set by
+    the in-memory stages (triangulation and relaxation): it still grows with
+    the size, but much slower.
+    """
+    if peakMemory() is None:
+        sys.exit("Peak memory is not available in this platform")
+    print("%8s %20s %20s" % ("seeds", "in memory", "out-of-core"))
+    for n in args.sizes:
+        results = []
+        for outOfCore in (False, True):
+            with tempfile.TemporaryDirectory() as folder, ProcessPoolExecutor(max_workers=1) as executor:
+                t, peak = executor.submit(cityPeakMemory, n, args.randomSeed, args.seeding,
+                                          folder if outOfCore else None).result()
+            results.append("%8.1f MB %8.2fs" % (peak, t))
+        print("%8d " % n + " ".join(results), flush=True)
+
+
+def benchCircumcenter(args):
+    """Compare the closed-form batched circumcircles() with the solver
+    used by Delaunay2D.circumcenter() for a set of random triangles.
+    """
+    rng = np.random.RandomState(args.randomSeed)
+    dt = Delaunay2D()
+    dt.reserve(3 * args.num)
+    dt.coords[:3 * args.num] = 1000 * rng.random_sample((3 * args.num, 2))
+    dt.numCoords = 3 * args.num
+    tris = np.arange(3 * args.num).reshape((args.num, 3))
+    pts = dt.coords[tris]
+
+    def solver():
+        return [dt.circumcenter(t) for t in tris]
+
+    def batched():
+        return circumcircles(pts[:, 0], pts[:, 1], pts[:, 2])
+
+    # Check both methods give the same solution
+    centers, radii = batched()
+    reference = solver()
+    # Relative to the radius, because near degenerate triangles have huge circles
+    error = max(np.linalg.norm(c - centers[i]) / sqrt(r) for i, (c, r) in enumerate(reference))
+    print("Triangles: %d  max relative center difference: %g" % (args.num, error))
+
+    tSolver = timeit(solver)
+    tBatched = timeit(batched)
+    print("  solver (np.linalg.solve): %10.6f s" % tSolver)
+    print("  batched closed form:      %10.6f s  (x%.1f faster)" % (tBatched, tSolver / tBatched))
+
+
+benchmarks = {
+    'backends': benchBackends,
+    'check': checkBackends,
+    'circumcenter': benchCircumcenter,
+    'compact': benchCompact,
+    'memory': benchMemory,
+    'parallel': benchParallel,
+    'relax': benchRelax,
+    'rmdf': benchRMDF,
+    'scaling': benchScaling,
+    'seeding': benchSeeding,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks for cityGen2D.')
+    parser.add_argument('benchmark', choices=sorted(benchmarks),
+                        help='Name of the benchmark to run')
+    parser.add_argument('-n', '--num', type=int, default=10000, required=False,
+                        help='Size of the problem (default=10000)')
+    parser.add_argument('--randomSeed', type=int, default=1, required=False,
+                        help='Initial random seed value (default=1)')
+    parser.add_argument('--sizes', type=int, nargs='+', required=False,
+                        default=[1000, 2000, 5000, 10000, 20000, 50000, 100000],
+                        help='List of problem sizes for the scaling benchmark')
+    parser.add_argument('--workers', type=int, nargs='+', required=False, default=[4, 8, 16],
+                        help='List of number of workers for the parallel benchmark')
+    parser.add_argument('--seeding', default='random', required=False, choices=['random', 'bridson', 'tiles'],
+                        help='Method to place the seeds of the cities (default=random)')
+    parser.add_argument('--repeat', type=int, default=5, required=False,
+                        help='Number of random seeds to check (default=5)')
+    args = parser.parse_args()
+    benchmarks[args.benchmark](args)
+
+
+if __name__ == "__main__":
+    main()